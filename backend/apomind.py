@@ -1,36 +1,131 @@
-import transformers
-from transformers import BitsAndBytesConfig
-import torch
+import os
+import copy
 import json  # ✅ Import JSON for structured output
+import time
+import threading
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer, set_seed
 
-compute_dtype = getattr(torch, "float16")
-bnb_config = BitsAndBytesConfig(
-        load_in_4bit=True,
-        bnb_4bit_quant_type='nf4',
-        bnb_4bit_compute_dtype=compute_dtype,
-        bnb_4bit_use_double_quant=False,
-)
+# The style model is loaded lazily (first use or warm_up()), so importing this
+# module is cheap and the API can start on CPU-only nodes.
+model_name = os.getenv("STYLE_BASE_MODEL", "microsoft/phi-2")
+ADAPTER_PATH = os.getenv("STYLE_ADAPTER_PATH", "./results-1741225651/checkpoint-100")
+STYLE_DEVICE = os.getenv("STYLE_DEVICE", "auto")  # auto | cpu | cuda
+STYLE_CPU_DTYPE = os.getenv("STYLE_CPU_DTYPE", "fp32")  # fp32 | bf16 | int8 (dynamic quantization)
+# Output of export_style_model.py: phi-2 with the adapter already merged, saved as safetensors
+MERGED_MODEL_PATH = os.getenv("STYLE_MERGED_MODEL_PATH", "./style-model-merged")
+STYLE_MODEL_VARIANT = os.getenv("STYLE_MODEL_VARIANT", "auto")  # auto | merged | peft
+
+device = "cuda" if STYLE_DEVICE == "auto" and torch.cuda.is_available() else ("cpu" if STYLE_DEVICE == "auto" else STYLE_DEVICE)
+
+tokenizer = None
+ft_model = None
+_load_lock = threading.Lock()
+_load_error = None
+_load_seconds = None
+
+
+def model_variant():
+    """"merged" when an exported model exists (or is forced), otherwise "peft"."""
+    if STYLE_MODEL_VARIANT != "auto":
+        return STYLE_MODEL_VARIANT
+    return "merged" if os.path.isdir(MERGED_MODEL_PATH) else "peft"
+
+
+def _load_base_model(path):
+    if device == "cuda":
+        # 4-bit NF4 on GPU, as before
+        from transformers import BitsAndBytesConfig
+        bnb_config = BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_quant_type='nf4',
+                bnb_4bit_compute_dtype=torch.float16,
+                bnb_4bit_use_double_quant=False,
+        )
+        return AutoModelForCausalLM.from_pretrained(path,
+                                                    device_map={"": 0},
+                                                    quantization_config=bnb_config,
+                                                    trust_remote_code=True)
+
+    dtype = torch.bfloat16 if STYLE_CPU_DTYPE == "bf16" else torch.float32
+    # safetensors checkpoints are memory-mapped rather than read into a second copy
+    return AutoModelForCausalLM.from_pretrained(path,
+                                                torch_dtype=dtype,
+                                                trust_remote_code=True,
+                                                low_cpu_mem_usage=True)
+
+
+def load_model():
+    """Load the tokenizer, phi-2 and the LoRA adapter once; safe to call from any thread."""
+    global tokenizer, ft_model, _load_error, _load_seconds
+    if ft_model is not None:
+        return ft_model
+    with _load_lock:
+        if ft_model is not None:
+            return ft_model
+        start = time.perf_counter()
+        try:
+            variant = model_variant()
+            path = MERGED_MODEL_PATH if variant == "merged" else model_name
+            tok = AutoTokenizer.from_pretrained(path, trust_remote_code=True,
+                                                padding_side="left",
+                                                add_eos_token=True, add_bos_token=True,
+                                                use_fast=False)
+            tok.pad_token = tok.eos_token
+
+            model = _load_base_model(path)
+            if variant == "peft":
+                from peft import PeftModel
+                model = PeftModel.from_pretrained(model, ADAPTER_PATH, is_trainable=False)
+            if device == "cpu" and STYLE_CPU_DTYPE == "int8":
+                # Dynamic int8 quantization needs plain Linear layers, so fold the adapter in first
+                if variant == "peft":
+                    model = model.merge_and_unload()
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            model.eval()
+            set_seed(42)
+        except Exception as e:
+            _load_error = str(e)
+            raise
+
+        tokenizer = tok
+        ft_model = model
+        _load_error = None
+        _load_seconds = time.perf_counter() - start
+        print(f"Style model ({variant}) loaded on {device} in {_load_seconds:.1f}s")
+        return ft_model
+
+
+def warm_up():
+    """Load the model in a background thread."""
+    def _run():
+        try:
+            load_model()
+        except Exception as e:
+            print("Style model warm-up failed:", str(e))
 
-from transformers import AutoModelForCausalLM
-model_name = 'microsoft/phi-2'
-device_map = {"": 0}
-original_model = AutoModelForCausalLM.from_pretrained(model_name,
-                                                      device_map=device_map,
-                                                      quantization_config=bnb_config,
-                                                      trust_remote_code=True,
-                                                      use_auth_token=True)
+    thread = threading.Thread(target=_run, name="style-model-warmup", daemon=True)
+    thread.start()
+    return thread
 
-from transformers import AutoTokenizer
-tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True,
-                                          padding_side="left",
-                                          add_eos_token=True, add_bos_token=True,
-                                          use_fast=False)
-tokenizer.pad_token = tokenizer.eos_token
 
-device = "cuda"
+def is_ready():
+    return ft_model is not None
+
+
+def status():
+    return {
+        "ready": is_ready(),
+        "variant": model_variant(),
+        "device": device,
+        "dtype": STYLE_CPU_DTYPE if device == "cpu" else "nf4",
+        "load_seconds": _load_seconds,
+        "error": _load_error,
+    }
+
 
 def gen(model, p, maxlen=100, sample=True):
-    toks = tokenizer(p, return_tensors="pt").to(device)
+    toks = tokenizer(p, return_tensors="pt", padding=True).to(device)
 
     res = model.generate(
         **toks,
@@ -44,13 +139,6 @@ def gen(model, p, maxlen=100, sample=True):
 
     return tokenizer.batch_decode(res, skip_special_tokens=True)
 
-from peft import PeftModel
-ft_model = PeftModel.from_pretrained(original_model, "./results-1741225651/checkpoint-100",
-                                     torch_dtype=torch.float16, is_trainable=False)
-from transformers import set_seed
-set_seed(42)
-
-import json
 import re
 
 def extract_json_from_text(text):
@@ -65,51 +153,202 @@ def extract_json_from_text(text):
             return None
     return None
 
-def generate_thinking_style(user_message):
-    """Generate thinking style percentages using the fine-tuned model."""
+STYLES = ["concrete", "logical", "theoretical", "practical", "intuitive"]
+
+# "generate" decodes the percentages (the default); "score" ranks the five labels in one forward
+# pass, but its prompt is not the template the adapter was trained on, so it stays opt-in until
+# bench_style_model.py shows it agrees with the labelled data
+STYLE_INFERENCE_MODE = os.getenv("STYLE_INFERENCE_MODE", "generate")
+
+# Prompts are split into a static prefix, whose KV cache is computed once per
+# model, and a per-message suffix that is the only part encoded per request.
+SCORE_PREFIX = (
+    "Instruct: Classify the user's thinking style as Concrete, Logical, Theoretical, Practical or Intuitive.\n"
+    "User Input:"
+)
+SCORE_SUFFIX = " {user_message}\nThinking style:"
 
-    # ✅ Strictly enforce JSON format in the prompt
-    prompt = f"""
+GENERATE_PREFIX = """
     You are an AI that strictly outputs JSON.
     Classify the user's thinking style in percentages.
     
     Respond **only** in this format:
     
-    {{
+    {
         "concrete": 30,
         "logical": 25,
         "theoretical": 20,
         "practical": 15,
         "intuitive": 10
-    }}
+    }
     
-    User Input: {user_message}
+    User Input:"""
+GENERATE_SUFFIX = """ {user_message}
     Output:
     """
 
+_prefix_cache = {}
+
+
+def _label_token_ids():
+    return [tokenizer(" " + style.capitalize(), add_special_tokens=False).input_ids for style in STYLES]
+
+
+@torch.no_grad()
+def _prefix_past(model, prefix):
+    """(prefix length, past_key_values) for a static prompt prefix, computed once per model."""
+    key = (id(model), prefix)
+    if key not in _prefix_cache:
+        ids = tokenizer(prefix, add_special_tokens=False).input_ids
+        out = model(input_ids=torch.tensor([ids], device=device), use_cache=True)
+        _prefix_cache[key] = (len(ids), out.past_key_values)
+    return _prefix_cache[key]
+
+
+def _expand_past(past, batch_size):
+    # Forward passes append to the cache in place, so every request gets its own copy
+    past = copy.deepcopy(past)
+    if hasattr(past, "batch_repeat_interleave"):
+        past.batch_repeat_interleave(batch_size)
+        return past
+    return tuple(tuple(t.repeat_interleave(batch_size, dim=0) for t in layer) for layer in past)
+
+
+def _suffix_batch(prefix_len, rows):
+    """Left-pad suffix rows after the cached prefix; returns input_ids, attention_mask, position_ids."""
+    max_len = max(len(row) for row in rows)
+    input_ids = torch.tensor([[tokenizer.pad_token_id] * (max_len - len(row)) + row for row in rows], device=device)
+    suffix_mask = torch.tensor([[0] * (max_len - len(row)) + [1] * len(row) for row in rows], device=device)
+    attention_mask = torch.cat([torch.ones(len(rows), prefix_len, dtype=suffix_mask.dtype, device=device),
+                                suffix_mask], dim=1)
+    position_ids = (attention_mask.cumsum(-1) - 1)[:, prefix_len:]
+    return input_ids, attention_mask, position_ids
+
+
+@torch.no_grad()
+def score_thinking_style_batch(user_messages, model=None):
+    """Score the five thinking styles for several messages with a single batched forward pass.
+
+    Each row is a message suffix followed by one label, run on top of the
+    cached instruction prefix; a label's summed log-likelihood is softmaxed
+    across its message's five rows, so every result is a deterministic
+    distribution in percentages.
+    """
+    model = model or load_model()
+    label_ids = _label_token_ids()
+    prefix_len, past = _prefix_past(model, SCORE_PREFIX)
+
+    rows = []
+    for user_message in user_messages:
+        suffix_ids = tokenizer(SCORE_SUFFIX.format(user_message=user_message), add_special_tokens=False).input_ids
+        rows.extend(suffix_ids + ids for ids in label_ids)
+
+    input_ids, attention_mask, position_ids = _suffix_batch(prefix_len, rows)
+    logits = model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids,
+                   past_key_values=_expand_past(past, len(rows)), use_cache=True).logits
+    logprobs = torch.log_softmax(logits[:, :-1].float(), dim=-1)
+    token_logprobs = logprobs.gather(-1, input_ids[:, 1:].unsqueeze(-1)).squeeze(-1)
+
+    label_scores = torch.stack([token_logprobs[i, -len(label_ids[i % len(STYLES)]):].sum() for i in range(len(rows))])
+    probs = torch.softmax(label_scores.view(len(user_messages), len(STYLES)), dim=-1).tolist()
+    return [{style: round(100 * p, 2) for style, p in zip(STYLES, row)} for row in probs]
+
+
+@torch.no_grad()
+def generate_with_prefix(model, prefix, suffixes, max_new_tokens=100, stop_text="}"):
+    """Greedy-decode each suffix on top of the cached prefix.
+
+    A row stops as soon as it emits `stop_text` (or EOS), and the whole batch
+    stops once every row has, instead of always running to max_new_tokens.
+    Returns only the generated text.
+    """
+    prefix_len, past = _prefix_past(model, prefix)
+    rows = [tokenizer(suffix, add_special_tokens=False).input_ids for suffix in suffixes]
+    input_ids, attention_mask, position_ids = _suffix_batch(prefix_len, rows)
+
+    out = model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids,
+                past_key_values=_expand_past(past, len(rows)), use_cache=True)
+    generated = [[] for _ in rows]
+    done = [False] * len(rows)
+
+    for _ in range(max_new_tokens):
+        next_tokens = out.logits[:, -1, :].argmax(dim=-1)
+        for i, token in enumerate(next_tokens.tolist()):
+            if done[i]:
+                continue
+            if token == tokenizer.eos_token_id:
+                done[i] = True
+                continue
+            generated[i].append(token)
+            if stop_text in tokenizer.decode([token]):
+                done[i] = True
+        if all(done):
+            break
+
+        next_tokens = next_tokens.masked_fill(torch.tensor(done, device=device), tokenizer.pad_token_id)
+        attention_mask = torch.cat([attention_mask, torch.ones(len(rows), 1, dtype=attention_mask.dtype, device=device)], dim=1)
+        position_ids = position_ids[:, -1:] + 1
+        out = model(input_ids=next_tokens.unsqueeze(-1), attention_mask=attention_mask, position_ids=position_ids,
+                    past_key_values=out.past_key_values, use_cache=True)
+
+    return [tokenizer.decode(tokens, skip_special_tokens=True) for tokens in generated]
+
+
+def score_thinking_style(user_message, model=None):
+    return score_thinking_style_batch([user_message], model)[0]
+
+
+def _default_styles():
+    return {"concrete": 0, "logical": 0, "theoretical": 0, "practical": 0, "intuitive": 0}
+
+
+def _parse_style_output(peft_model_output):
+    # ✅ First Attempt: Parse JSON directly
     try:
-        # ✅ Generate response
-        peft_model_res = gen(ft_model, prompt, 100)
-        peft_model_output = peft_model_res[0].strip()
+        return json.loads(peft_model_output)
+    except json.JSONDecodeError:
+        pass  # Fall back to regex extraction
 
-        # ✅ Debug Print
-        print("Raw Model Output:", peft_model_output)
+    # ✅ Second Attempt: Extract JSON using regex
+    extracted_json = extract_json_from_text(peft_model_output)
+    if extracted_json:
+        return extracted_json
+
+    raise ValueError("Could not extract valid JSON")
 
-        # ✅ First Attempt: Parse JSON directly
-        try:
-            parsed_output = json.loads(peft_model_output)
-            return parsed_output  # ✅ If successful, return
-        except json.JSONDecodeError:
-            pass  # Fall back to regex extraction
 
-        # ✅ Second Attempt: Extract JSON using regex
-        extracted_json = extract_json_from_text(peft_model_output)
-        if extracted_json:
-            return extracted_json
+def generate_thinking_style_batch(user_messages):
+    """Thinking style percentages for a batch of messages (one padded batch through the model)."""
 
-        # If all fails, return default values
-        raise ValueError("Could not extract valid JSON")
+    if STYLE_INFERENCE_MODE == "score":
+        try:
+            return score_thinking_style_batch(user_messages)
+        except Exception as e:
+            print("Error scoring thinking style:", str(e))
+            return [_default_styles() for _ in user_messages]
 
+    try:
+        # ✅ Generate responses: cached instruction prefix, stop at the closing brace
+        suffixes = [GENERATE_SUFFIX.format(user_message=user_message) for user_message in user_messages]
+        peft_model_res = generate_with_prefix(load_model(), GENERATE_PREFIX, suffixes, 100)
     except Exception as e:
         print("Error processing model output:", str(e))
-        return {"concrete": 0, "logical": 0, "theoretical": 0, "practical": 0, "intuitive": 0}  # Return default
+        return [_default_styles() for _ in user_messages]
+
+    results = []
+    for text in peft_model_res:
+        peft_model_output = text.strip()
+
+        # ✅ Debug Print
+        print("Raw Model Output:", peft_model_output)
+        try:
+            results.append(_parse_style_output(peft_model_output))
+        except Exception as e:
+            print("Error processing model output:", str(e))
+            results.append(_default_styles())  # Return default
+    return results
+
+
+def generate_thinking_style(user_message):
+    """Generate thinking style percentages using the fine-tuned model."""
+    return generate_thinking_style_batch([user_message])[0]
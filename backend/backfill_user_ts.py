@@ -0,0 +1,142 @@
+"""Recompute every user's thinking-style profile from their chat history.
+
+Streams `chat_history` user messages in id order (keyset pagination), runs
+the style model over them in padded batches and folds each user's results
+with the same rule as style_updates: the first message counts in
+full, every later one adds 0.15 * its scores. The resulting profiles are
+bulk-upserted into `user_ts`, replacing the old ones.
+
+Progress (last chat_history id and the partial profiles) is checkpointed
+after every page, so an interrupted run resumes where it stopped.
+
+Drain the API and style workers first: the final upsert replaces whole rows,
+so increments flushed while the script runs are lost. It also only
+refreshes this process's profile cache; API workers pick up the new rows
+through PROFILE_CACHE_DB or once PROFILE_CACHE_TTL expires (or restart them).
+
+Usage:
+    python backfill_user_ts.py [--page-size 1000] [--model-batch 16] [--restart] [--dry-run]
+"""
+import os
+import json
+import time
+import argparse
+
+from db import supabase, upsert_user_ts, STYLE_KEYS
+from style_updates import UPDATE_WEIGHT
+UPSERT_PAGE_SIZE = 1000
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return {"last_id": 0, "messages": 0, "profiles": {}, "upserted": False}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, state):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(temp_path, path)
+
+
+def fetch_page(last_id, page_size):
+    """Next page of user messages after last_id, oldest first."""
+    return (supabase.table("chat_history").select("id, uid, message")
+            .eq("role", "user").gt("id", last_id).order("id").limit(page_size).execute().data)
+
+
+def infer_page(messages, model_batch, max_chars):
+    """Style scores for every message; batches are built from similar lengths to limit padding."""
+    from apomind import generate_thinking_style_batch  # loads torch; only needed here
+
+    clipped = [message[:max_chars] for message in messages]
+    order = sorted(range(len(clipped)), key=lambda i: len(clipped[i]))
+    results = [None] * len(clipped)
+    for start in range(0, len(order), model_batch):
+        batch = order[start:start + model_batch]
+        for i, styles in zip(batch, generate_thinking_style_batch([clipped[i] for i in batch])):
+            results[i] = styles
+    return results
+
+
+def fold(profiles, user_id, styles):
+    key = str(user_id)
+    values = {style: float(styles.get(style, 0) or 0) for style in STYLE_KEYS}
+    if key not in profiles:
+        profiles[key] = values
+    else:
+        for style, value in values.items():
+            profiles[key][style] += UPDATE_WEIGHT * value
+
+
+def fetch_usernames(user_ids):
+    """id -> username, from user_ts first and user_subject_sel for users without a profile yet."""
+    usernames = {}
+    for table in ("user_ts", "user_subject_sel"):
+        missing = [user_id for user_id in user_ids if user_id not in usernames]
+        for start in range(0, len(missing), UPSERT_PAGE_SIZE):
+            rows = (supabase.table(table).select("id, username")
+                    .in_("id", missing[start:start + UPSERT_PAGE_SIZE]).execute().data)
+            usernames.update({row["id"]: row["username"] for row in rows if row.get("username")})
+    return usernames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--page-size", type=int, default=1000, help="chat_history rows per page")
+    parser.add_argument("--model-batch", type=int, default=16, help="Messages per model forward pass")
+    parser.add_argument("--max-chars", type=int, default=2000, help="Clip longer messages before inference")
+    parser.add_argument("--checkpoint", default="backfill_user_ts.checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint")
+    parser.add_argument("--dry-run", action="store_true", help="Compute profiles but do not write user_ts")
+    args = parser.parse_args()
+
+    state = {"last_id": 0, "messages": 0, "profiles": {}, "upserted": False} if args.restart \
+        else load_checkpoint(args.checkpoint)
+    if state["upserted"]:
+        print(f"{args.checkpoint} is from a finished run; use --restart to recompute")
+        return
+    if state["last_id"]:
+        print(f"Resuming after chat_history id {state['last_id']} ({state['messages']} messages done)")
+
+    start = time.perf_counter()
+    while True:
+        page = fetch_page(state["last_id"], args.page_size)
+        if not page:
+            break
+        page_start = time.perf_counter()
+        for row, styles in zip(page, infer_page([row["message"] or "" for row in page],
+                                                args.model_batch, args.max_chars)):
+            fold(state["profiles"], row["uid"], styles)
+        state["last_id"] = page[-1]["id"]
+        state["messages"] += len(page)
+        save_checkpoint(args.checkpoint, state)
+        print(f"{state['messages']} messages, {len(state['profiles'])} users "
+              f"({len(page) / (time.perf_counter() - page_start):.1f} msg/s)")
+
+    profiles = {int(user_id): styles for user_id, styles in state["profiles"].items()}
+    usernames = fetch_usernames(list(profiles))
+    rows = [{"id": user_id, "username": usernames[user_id],
+             **styles, "timestamp": "now()"}
+            for user_id, styles in profiles.items() if user_id in usernames]
+    if len(rows) < len(profiles):
+        print(f"Skipping {len(profiles) - len(rows)} users without a username")
+
+    if args.dry_run:
+        print(json.dumps(rows[:5], indent=2))
+        print(f"Dry run: {len(rows)} profiles not written")
+        return
+    print("Writing profiles; the API and style workers must be stopped, "
+          "or their increments since the start of the run are overwritten")
+    for offset in range(0, len(rows), UPSERT_PAGE_SIZE):
+        upsert_user_ts(rows[offset:offset + UPSERT_PAGE_SIZE])
+    state["upserted"] = True
+    save_checkpoint(args.checkpoint, state)
+    print(f"Upserted {len(rows)} profiles in {time.perf_counter() - start:.1f}s. "
+          "Run batch_recommend.py to refresh stored recommendations.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import random
+import asyncio
+import logging
+
+# Shared loop for the write-behind queues (chat_persistence, style_updates):
+# a background task drains pending work on a time trigger or when woken,
+# retrying failed writes with jittered exponential backoff.
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0):
+    """min(cap, base * 2 ** attempt), jittered by a factor of 0.5-1.5."""
+    return min(cap, base * 2 ** attempt) * (0.5 + random.random())
+
+
+class BackgroundFlusher:
+    """Calls `drain()` every flush_interval seconds, or sooner after `wake()`.
+
+    Subclasses implement `drain()`. `stop()` runs one last drain before
+    returning, so nothing queued is lost on shutdown.
+    """
+
+    def __init__(self, flush_interval, max_retries):
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything still queued, then stop the background task."""
+        if not self.running:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+
+    def wake(self):
+        """Drain now instead of at the next interval; safe to call from any thread."""
+        if self.running:
+            self._task.get_loop().call_soon_threadsafe(self._wakeup.set)
+
+    async def drain(self):
+        raise NotImplementedError
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            await self.drain()
+            if self._stopping:
+                return
+
+    async def write_with_retries(self, write, *args, name, items):
+        """Run the blocking `write(*args)` in a thread, retrying up to max_retries times."""
+        for attempt in range(self.max_retries):
+            try:
+                await asyncio.to_thread(write, *args)
+                return
+            except Exception as e:
+                if attempt == self.max_retries - 1:
+                    logging.error(f"Dropping {items} after {self.max_retries} attempts: {str(e)}")
+                    return
+                delay = backoff_delay(attempt)
+                logging.warning(f"{name} failed ({str(e)}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
@@ -0,0 +1,72 @@
+"""Precompute career recommendations for every user.
+
+Loads all `user_ts` and `user_subject_sel` rows, scores every user against
+every career in one vectorized pass per chunk and upserts the top-k into
+the `career_recommendations` table (see sql/career_recommendations.sql).
+Users whose inputs are unchanged since the last run are skipped.
+
+Usage:
+    python batch_recommend.py [--top-k 5] [--all]
+"""
+import time
+import argparse
+
+from db import STYLE_KEYS
+from recomendation import (supabase, load_artifact, score_users, inputs_hash, store_recommendations,
+                           split_subjects, RECOMMENDATIONS_TABLE)
+
+PAGE_SIZE = 1000
+
+
+def fetch_all(table, columns):
+    """Read a whole table in PAGE_SIZE pages."""
+    rows, start = [], 0
+    while True:
+        page = supabase.table(table).select(columns).range(start, start + PAGE_SIZE - 1).execute().data
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            return rows
+        start += PAGE_SIZE
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Users per forward pass")
+    parser.add_argument("--all", action="store_true", help="Recompute users whose inputs did not change")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    artifact = load_artifact()
+    styles = {row["username"]: [float(row.get(key) or 0) for key in STYLE_KEYS]
+              for row in fetch_all("user_ts", "username, " + ", ".join(STYLE_KEYS))}
+    subjects = {row["username"]: split_subjects(row.get("selected_subjects"))
+                for row in fetch_all("user_subject_sel", "username, selected_subjects")}
+    existing = {row["username"]: row.get("inputs_hash")
+                for row in fetch_all(RECOMMENDATIONS_TABLE, "username, inputs_hash")}
+
+    usernames, hashes = [], []
+    for username in sorted(styles.keys() & subjects.keys()):
+        digest = inputs_hash(styles[username], subjects[username], artifact["version"])
+        if args.all or existing.get(username) != digest:
+            usernames.append(username)
+            hashes.append(digest)
+    print(f"{len(usernames)} of {len(styles.keys() & subjects.keys())} users need recomputing")
+
+    for offset in range(0, len(usernames), args.chunk_size):
+        chunk = usernames[offset:offset + args.chunk_size]
+        results = score_users(artifact, [styles[u] for u in chunk], [subjects[u] for u in chunk], args.top_k)
+        rows = [{
+            "username": username,
+            "recommendations": recommendations,
+            "inputs_hash": digest,
+            "artifact_version": artifact["version"],
+        } for username, recommendations, digest in zip(chunk, results, hashes[offset:offset + args.chunk_size])]
+        for i in range(0, len(rows), PAGE_SIZE):
+            store_recommendations(rows[i:i + PAGE_SIZE])
+
+    print(f"Done in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Benchmark the thinking-style model: load time, per-request latency and memory.
+
+Each variant runs in a fresh subprocess so load time and peak RSS are not
+polluted by the other one. Prompts come from `codata .jsonl`, and the
+labelled responses there are used to report agreement: how often the
+dominant style matches (top1) and the mean absolute error in percentage
+points (mae).
+
+Usage:
+    python bench_style_model.py --variants peft merged --limit 20 [--dtype int8]
+"""
+import os
+import sys
+import json
+import time
+import re
+import argparse
+import resource
+import subprocess
+import statistics
+
+
+STYLES = ["concrete", "logical", "theoretical", "practical", "intuitive"]
+
+
+def parse_response(text):
+    """{style: percent} from a "Concrete: 70.0%, Logical: 10.0%, ..." label."""
+    found = {name.lower(): float(value) for name, value in re.findall(r"(\w+):\s*([\d.]+)%", text)}
+    return {style: found.get(style, 0.0) for style in STYLES}
+
+
+def load_examples(path, limit):
+    """(prompt, expected {style: percent}) pairs."""
+    examples = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                row = json.loads(line)
+                examples.append((row["prompt"], parse_response(row.get("response", ""))))
+    return examples[:limit]
+
+
+def agreement(predictions, expected):
+    top1 = [max(STYLES, key=lambda s: float(p.get(s, 0) or 0)) == max(STYLES, key=e.get)
+            for p, e in zip(predictions, expected)]
+    errors = [abs(float(p.get(s, 0) or 0) - e[s]) for p, e in zip(predictions, expected) for s in STYLES]
+    return sum(top1) / len(top1), sum(errors) / len(errors)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_worker(args):
+    """Measure one variant inside this process (env is already set by the parent)."""
+    import apomind
+
+    examples = load_examples(args.data, args.limit)
+    prompts = [prompt for prompt, _ in examples]
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    apomind.load_model()
+    load_seconds = time.perf_counter() - start
+
+    apomind.generate_thinking_style(prompts[0])  # warm-up (also builds the prefix cache)
+    latencies, predictions = [], []
+    for prompt in prompts:
+        t = time.perf_counter()
+        predictions.append(apomind.generate_thinking_style(prompt))
+        latencies.append((time.perf_counter() - t) * 1000)
+    top1, mae = agreement(predictions, [expected for _, expected in examples])
+
+    latencies.sort()
+    print(json.dumps({
+        "variant": apomind.model_variant(),
+        "mode": apomind.STYLE_INFERENCE_MODE,
+        "load_s": round(load_seconds, 2),
+        "mean_ms": round(statistics.mean(latencies), 1),
+        "p50_ms": round(latencies[len(latencies) // 2], 1),
+        "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1),
+        "rss_mb": round(peak_rss_mb(), 0),
+        "model_rss_mb": round(peak_rss_mb() - rss_before, 0),
+        "top1": round(top1, 3),
+        "mae": round(mae, 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--variants", nargs="+", default=["peft", "merged"], choices=["peft", "merged"])
+    parser.add_argument("--data", default="codata .jsonl")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--dtype", default=os.getenv("STYLE_CPU_DTYPE", "fp32"), help="STYLE_CPU_DTYPE for the run")
+    parser.add_argument("--mode", default=os.getenv("STYLE_INFERENCE_MODE", "generate"), choices=["score", "generate"])
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    rows = []
+    for variant in args.variants:
+        env = {**os.environ, "STYLE_MODEL_VARIANT": variant, "STYLE_CPU_DTYPE": args.dtype,
+               "STYLE_INFERENCE_MODE": args.mode}
+        cmd = [sys.executable, __file__, "--worker", "--data", args.data, "--limit", str(args.limit)]
+        result = subprocess.run(cmd, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"{variant} failed:\n{result.stderr}")
+            continue
+        rows.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+    header = ["variant", "mode", "load_s", "mean_ms", "p50_ms", "p95_ms", "rss_mb", "model_rss_mb", "top1", "mae"]
+    print(" | ".join(f"{h:>12}" for h in header))
+    for row in rows:
+        print(" | ".join(f"{str(row[h]):>12}" for h in header))
+
+
+if __name__ == "__main__":
+    main()
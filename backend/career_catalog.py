@@ -0,0 +1,96 @@
+import time
+import json
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+STYLE_COLUMNS = ['Concrete', 'Logical', 'Theoretical', 'Practical', 'Intuitive']
+
+
+def split_subjects(value):
+    """Split a comma-separated subject string into clean names."""
+    if not isinstance(value, str):
+        return []
+    return [subj.strip() for subj in value.split(',') if subj.strip()]
+
+
+def normalize_styles(matrix):
+    """Scale each row of thinking-style scores to sum to 1."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    totals = matrix.sum(axis=1, keepdims=True)
+    return np.divide(matrix, totals, out=np.zeros_like(matrix), where=totals > 0)
+
+
+def catalog_version(careers_df):
+    """Content hash of the career catalog."""
+    columns = [col for col in ['career_id', 'career_name', 'prerequisites'] + STYLE_COLUMNS if col in careers_df.columns]
+    rows = careers_df[columns].astype(str).sort_values(columns[0]).values.tolist()
+    return hashlib.sha256(json.dumps(rows).encode("utf-8")).hexdigest()[:12]
+
+
+class CareerCatalog:
+    """Career table preprocessed into arrays.
+
+    incidence is a sparse subject x career matrix (1 where the subject is a
+    prerequisite) and styles is the row-normalized career style matrix.
+    """
+
+    def __init__(self, careers_df):
+        self.careers_df = careers_df.reset_index(drop=True)
+        self.version = catalog_version(self.careers_df)
+        self.career_ids = [str(v) for v in self.careers_df['career_id']]
+        self.career_names = [str(v) for v in self.careers_df['career_name']]
+        self.styles = normalize_styles(self.careers_df.reindex(columns=STYLE_COLUMNS).fillna(0.0).astype(float).values)
+
+        # One vectorized split/explode instead of walking rows with iterrows()
+        prereqs = (self.careers_df['prerequisites'].where(self.careers_df['prerequisites'].apply(lambda v: isinstance(v, str)), "")
+                   .str.split(',').explode().str.strip())
+        prereqs = prereqs[prereqs.astype(bool)]
+        codes, subjects = pd.factorize(prereqs, sort=True)
+        self.subjects = list(subjects)
+        self.subject_to_idx = {subj: i for i, subj in enumerate(self.subjects)}
+
+        incidence = sparse.coo_matrix((np.ones(len(codes), dtype=np.float32), (codes, prereqs.index.values)),
+                                      shape=(len(self.subjects), len(self.careers_df))).tocsr()
+        incidence.data[:] = 1.0  # a subject listed twice for one career is still one edge
+        self.incidence = incidence
+
+    @property
+    def empty(self):
+        return self.careers_df.empty
+
+    def subject_indices(self, subjects):
+        return [self.subject_to_idx[subj] for subj in subjects if subj in self.subject_to_idx]
+
+
+class CatalogCache:
+    """Process-wide CareerCatalog, refetched after `ttl` seconds or on invalidate()."""
+
+    def __init__(self, fetch, ttl):
+        self._fetch = fetch
+        self.ttl = ttl
+        self._catalog = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, force=False):
+        if not force and self._catalog is not None and time.monotonic() - self._fetched_at < self.ttl:
+            return self._catalog
+        with self._lock:
+            if not force and self._catalog is not None and time.monotonic() - self._fetched_at < self.ttl:
+                return self._catalog
+            careers_df = self._fetch()
+            if careers_df.empty and self._catalog is not None:
+                # Keep serving the last good catalog if the refetch failed
+                self._fetched_at = time.monotonic()
+                return self._catalog
+            # Only rebuild the arrays when the content actually changed
+            if self._catalog is None or catalog_version(careers_df) != self._catalog.version:
+                self._catalog = CareerCatalog(careers_df) if not careers_df.empty else None
+            self._fetched_at = time.monotonic()
+            return self._catalog
+
+    def invalidate(self):
+        self._fetched_at = 0.0
@@ -0,0 +1,42 @@
+import os
+import logging
+from dotenv import load_dotenv
+
+from db import insert_chat_messages
+from background_flush import BackgroundFlusher
+
+# Write-behind queue for chat_history: endpoints enqueue rows and return,
+# a background task bulk-inserts them on a size or time trigger.
+load_dotenv()
+FLUSH_SIZE = int(os.getenv("CHAT_FLUSH_SIZE", "100"))
+FLUSH_INTERVAL = float(os.getenv("CHAT_FLUSH_INTERVAL", "1.0"))
+MAX_RETRIES = int(os.getenv("CHAT_FLUSH_RETRIES", "5"))
+MAX_PENDING = int(os.getenv("CHAT_MAX_PENDING", "50000"))
+
+
+class ChatWriter(BackgroundFlusher):
+    def __init__(self, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL, max_retries=MAX_RETRIES):
+        super().__init__(flush_interval, max_retries)
+        self.flush_size = flush_size
+        self._pending = []
+
+    def enqueue(self, rows):
+        """Queue chat_history rows; never blocks the caller on the database."""
+        if not self.running:
+            insert_chat_messages(rows)  # no event loop task (scripts, tests)
+            return
+        if len(self._pending) + len(rows) > MAX_PENDING:
+            logging.error(f"Chat write queue full, dropping {len(rows)} rows")
+            return
+        self._pending.extend(rows)
+        if len(self._pending) >= self.flush_size:
+            self.wake()
+
+    async def drain(self):
+        while self._pending:
+            batch, self._pending = self._pending[:self.flush_size], self._pending[self.flush_size:]
+            await self.write_with_retries(insert_chat_messages, batch,
+                                          name="Chat insert", items=f"{len(batch)} chat rows")
+
+
+chat_writer = ChatWriter()
@@ -0,0 +1,85 @@
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+from dotenv import load_dotenv
+
+from db import recent_chat_messages
+
+# Per-user conversation memory for the document Q&A endpoint. Each user gets
+# a bounded ring buffer, hydrated from chat_history on first use and dropped
+# after CONVERSATION_IDLE_TTL seconds without activity.
+load_dotenv()
+MAX_MESSAGES = int(os.getenv("CONVERSATION_MAX_MESSAGES", "20"))
+IDLE_TTL = float(os.getenv("CONVERSATION_IDLE_TTL", "1800"))
+MAX_USERS = int(os.getenv("CONVERSATION_MAX_USERS", "10000"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("CONVERSATION_TOKEN_BUDGET", "1500"))
+
+ROLES = {"user": "user", "bot": "assistant"}  # chat_history role -> OpenAI role
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token); no tokenizer needed."""
+    return len(text) // 4 + 1
+
+
+class ConversationStore:
+    def __init__(self, max_messages=MAX_MESSAGES, idle_ttl=IDLE_TTL, max_users=MAX_USERS):
+        self.max_messages = max_messages
+        self.idle_ttl = idle_ttl
+        self.max_users = max_users
+        self._buffers = OrderedDict()  # user_id -> (last_used, deque), least recently used first
+        self._lock = threading.Lock()
+
+    def _evict(self, now):
+        while self._buffers:
+            user_id, (last_used, _) = next(iter(self._buffers.items()))
+            if now - last_used < self.idle_ttl and len(self._buffers) <= self.max_users:
+                return
+            del self._buffers[user_id]
+
+    def history(self, user_id):
+        """The user's recent messages, loading them from chat_history if not in memory."""
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            entry = self._buffers.get(user_id)
+            if entry:
+                self._buffers[user_id] = (now, entry[1])
+                self._buffers.move_to_end(user_id)
+                return list(entry[1])
+
+        rows = recent_chat_messages(user_id, self.max_messages)
+        messages = [{"role": ROLES.get(row["role"], row["role"]), "content": row["message"]} for row in rows]
+        with self._lock:
+            # Another request may have hydrated (and appended to) it meanwhile
+            entry = self._buffers.setdefault(user_id, (now, deque(messages, maxlen=self.max_messages)))
+            self._buffers.move_to_end(user_id)
+            self._evict(now)
+            return list(entry[1])
+
+    def append(self, user_id, *messages):
+        now = time.time()
+        with self._lock:
+            entry = self._buffers.get(user_id)
+            buffer = entry[1] if entry else deque(maxlen=self.max_messages)
+            buffer.extend(messages)
+            self._buffers[user_id] = (now, buffer)
+            self._buffers.move_to_end(user_id)
+            self._evict(now)
+
+    def build_messages(self, user_id, system_prompt, question, token_budget=HISTORY_TOKEN_BUDGET):
+        """system prompt + as much recent history as fits in token_budget + the new question."""
+        kept, used = [], 0
+        for message in reversed(self.history(user_id)):
+            used += estimate_tokens(message["content"])
+            if used > token_budget:
+                break
+            kept.append(message)
+        return [system_prompt] + kept[::-1] + [{"role": "user", "content": question}]
+
+    def __len__(self):
+        return len(self._buffers)
+
+
+conversations = ConversationStore()
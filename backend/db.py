@@ -0,0 +1,87 @@
+import os
+from dotenv import load_dotenv
+from supabase import create_client, Client
+from profile_cache import ProfileCache
+
+# Single Supabase client for the whole backend. Its HTTP session keeps
+# connections alive, so every module should go through here instead of
+# calling create_client itself.
+load_dotenv()
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+STYLE_KEYS = ["concrete", "logical", "theoretical", "practical", "intuitive"]
+
+# user_ts rows are read on almost every chat turn but change slowly
+profile_cache = ProfileCache()
+
+
+def get_user_ts(user_id):
+    """The user's user_ts row (includes username), or None. Served from profile_cache when possible."""
+    row = profile_cache.get(user_id)
+    if row is not None:
+        return row
+    # Taken before the read, so a flush that invalidates meanwhile keeps this (old) row out of the cache
+    token = profile_cache.token(user_id)
+    rows = supabase.table("user_ts").select("*").eq("id", user_id).limit(1).execute().data
+    if not rows:
+        return None
+    profile_cache.set(user_id, rows[0], token=token)
+    return rows[0]
+
+
+def get_selection_username(user_id):
+    """Username from user_subject_sel, or None."""
+    rows = supabase.table("user_subject_sel").select("username").eq("id", user_id).limit(1).execute().data
+    return rows[0]["username"] if rows else None
+
+
+def upsert_user_ts(rows):
+    """Insert-or-update user_ts rows in one round trip, writing through profile_cache."""
+    if not rows:
+        return
+    try:
+        stored = supabase.table("user_ts").upsert(rows, on_conflict="id").execute().data
+    except Exception:
+        for row in rows:
+            profile_cache.invalidate(row["id"])
+        raise
+    # Cache what the database returned (it has the real timestamp), else what we sent
+    for row in stored or rows:
+        profile_cache.set(row["id"], row)
+
+
+def increment_user_ts(updates, batch_id):
+    """Apply coalesced style deltas server-side (sql/increment_user_ts.sql); one round trip.
+
+    The function records batch_id and ignores a batch it has already applied,
+    so the same (batch_id, updates) can safely be retried.
+    """
+    if not updates:
+        return
+    supabase.rpc("increment_user_ts", {"batch_id": batch_id, "updates": updates}).execute()
+    # The new values only exist in the database now
+    for update in updates:
+        profile_cache.invalidate(update["id"])
+
+
+def insert_chat_messages(rows):
+    """Insert several chat_history rows in one round trip."""
+    if rows:
+        supabase.table("chat_history").insert(rows).execute()
+
+
+def recent_chat_messages(user_id, limit):
+    """The user's last `limit` chat_history rows, oldest first."""
+    rows = (supabase.table("chat_history").select("role, message").eq("uid", user_id)
+            .order("id", desc=True).limit(limit).execute().data)
+    return rows[::-1]
+
+
+def chat_turn_rows(user_id, user_message, bot_response):
+    return [
+        {"uid": user_id, "role": "user", "message": user_message},
+        {"uid": user_id, "role": "bot", "message": bot_response},
+    ]
@@ -0,0 +1,130 @@
+import os
+import asyncio
+import hashlib
+import logging
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dotenv import load_dotenv
+from pypdf import PdfReader
+from docx import Document
+
+# Text extraction for uploaded documents. Parsing is CPU-bound, so it runs in
+# a small process pool instead of on the event loop, and it stops reading
+# pages as soon as enough text has been collected.
+load_dotenv()
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "2"))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_DIR = os.getenv("UPLOAD_DIR") or None  # None = system temp dir
+SUPPORTED_TYPES = (".txt", ".pdf", ".docx")
+CHUNK_SIZE = 1024 * 1024
+
+_pool = None
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+def iter_text(file_path):
+    """Yield a file's text piece by piece (PDF pages, DOCX paragraphs, TXT blocks)."""
+    if file_path.endswith(".txt"):
+        with open(file_path, "r", encoding="utf-8") as file:
+            while True:
+                block = file.read(64 * 1024)
+                if not block:
+                    return
+                yield block
+    elif file_path.endswith(".pdf"):
+        for page in PdfReader(file_path).pages:
+            text = page.extract_text()
+            if text:
+                yield text
+    elif file_path.endswith(".docx"):
+        for para in Document(file_path).paragraphs:
+            yield para.text
+    else:
+        raise ValueError("Unsupported file type. Use TXT, PDF, or DOCX.")
+
+
+def extract_text(file_path, max_chars=None):
+    """Text of the file, reading no further than max_chars.
+
+    PDF pages and DOCX paragraphs are joined with "\\n" like before; TXT blocks
+    are concatenated as-is, so a TXT file comes back unchanged.
+    """
+    separator = "" if file_path.endswith(".txt") else "\n"
+    parts, total = [], 0
+    for part in iter_text(file_path):
+        parts.append(part)
+        total += len(part) + len(separator)
+        if max_chars is not None and total >= max_chars:
+            break
+    text = separator.join(parts)
+    return text[:max_chars] if max_chars is not None else text
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # Not fork: the API process has torch loaded and live threads, and a
+        # forked child can deadlock on a lock one of them held
+        _pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS,
+                                    mp_context=multiprocessing.get_context("forkserver"))
+    return _pool
+
+
+def _reset_pool(broken):
+    global _pool
+    if _pool is broken:
+        _pool = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+
+async def extract_text_async(file_path, max_chars=None):
+    """extract_text in the extraction process pool; a pool whose worker died is replaced once."""
+    loop = asyncio.get_running_loop()
+    pool = _get_pool()
+    try:
+        return await loop.run_in_executor(pool, extract_text, file_path, max_chars)
+    except BrokenProcessPool:
+        logging.warning("Extraction worker died, restarting the pool and retrying")
+        _reset_pool(pool)
+        return await loop.run_in_executor(_get_pool(), extract_text, file_path, max_chars)
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+async def save_upload(upload, max_bytes=UPLOAD_MAX_BYTES):
+    """Copy an UploadFile to a private temp file, refusing anything over max_bytes.
+
+    The temp file keeps the upload's extension so extraction can pick a parser.
+    Returns (path, sha256 hex digest of the bytes); the caller removes the file.
+    """
+    suffix = os.path.splitext(upload.filename or "")[1].lower()
+    if suffix not in SUPPORTED_TYPES:
+        raise ValueError("Unsupported file type. Use TXT, PDF, or DOCX.")
+    if (getattr(upload, "size", None) or 0) > max_bytes:
+        raise UploadTooLarge(f"File exceeds {max_bytes} bytes")
+
+    temp = tempfile.NamedTemporaryFile(suffix=suffix, dir=UPLOAD_DIR, delete=False)
+    digest = hashlib.sha256()
+    try:
+        with temp:
+            written = 0
+            while chunk := await upload.read(CHUNK_SIZE):
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadTooLarge(f"File exceeds {max_bytes} bytes")
+                digest.update(chunk)
+                temp.write(chunk)
+    except BaseException:
+        os.remove(temp.name)
+        raise
+    return temp.name, digest.hexdigest()
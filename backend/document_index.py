@@ -0,0 +1,106 @@
+import os
+import re
+import math
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from dotenv import load_dotenv
+
+from conversation_store import estimate_tokens
+
+# Lexical retrieval over stored documents: each document is cut into
+# overlapping word windows and indexed with BM25, and only the chunks that
+# match the question are sent to the model.
+load_dotenv()
+CHUNK_WORDS = int(os.getenv("DOCUMENT_CHUNK_WORDS", "200"))
+CHUNK_OVERLAP = int(os.getenv("DOCUMENT_CHUNK_OVERLAP", "40"))
+TOP_K = int(os.getenv("DOCUMENT_TOP_K", "6"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("DOCUMENT_TOKEN_BUDGET", "1000"))  # ~ the old 4000 characters
+INDEX_CACHE_SIZE = int(os.getenv("DOCUMENT_INDEX_CACHE_SIZE", "64"))
+
+TOKEN = re.compile(r"\w+")
+K1 = 1.5
+B = 0.75
+
+
+def tokenize(text):
+    return TOKEN.findall(text.lower())
+
+
+def chunk_text(text, chunk_words=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    """Overlapping windows of chunk_words words (whitespace is normalized)."""
+    words = text.split()
+    step = max(1, chunk_words - overlap)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + chunk_words]))
+        if start + chunk_words >= len(words):
+            break
+    return chunks
+
+
+class BM25Index:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.lengths = []
+        self.postings = defaultdict(list)  # term -> [(chunk index, term frequency)]
+        for i, chunk in enumerate(chunks):
+            counts = Counter(tokenize(chunk))
+            self.lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings[term].append((i, tf))
+        self.avg_length = sum(self.lengths) / len(self.lengths) if chunks else 0.0
+
+    def scores(self, query):
+        n = len(self.chunks)
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for i, tf in postings:
+                norm = K1 * (1 - B + B * self.lengths[i] / self.avg_length)
+                scores[i] += idf * tf * (K1 + 1) / (tf + norm)
+        return scores
+
+    def context(self, query, top_k=TOP_K, token_budget=CONTEXT_TOKEN_BUDGET):
+        """The best-matching chunks that fit token_budget, joined in document order.
+
+        Falls back to the start of the document when nothing matches.
+        """
+        scores = self.scores(query)
+        ranked = sorted(scores, key=lambda i: -scores[i])[:top_k] or range(min(top_k, len(self.chunks)))
+        selected, used = [], 0
+        for i in ranked:
+            cost = estimate_tokens(self.chunks[i])
+            if used + cost > token_budget:
+                continue
+            selected.append(i)
+            used += cost
+        if not selected and self.chunks:
+            # Even the best chunk is over budget on its own; send a prefix of it
+            return self.chunks[ranked[0]][:token_budget * 4]
+        return "\n...\n".join(self.chunks[i] for i in sorted(selected))
+
+
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_index(doc_id, text):
+    """BM25 index for a document, cached for the INDEX_CACHE_SIZE most recent documents."""
+    with _lock:
+        index = _indexes.get(doc_id)
+        if index is not None:
+            _indexes.move_to_end(doc_id)
+            return index
+    index = BM25Index(chunk_text(text))
+    with _lock:
+        _indexes[doc_id] = index
+        while len(_indexes) > INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
+
+
+def document_context(doc_id, text, question):
+    return get_index(doc_id, text).context(question)
@@ -0,0 +1,101 @@
+import os
+import re
+import asyncio
+import time
+import logging
+import threading
+from dotenv import load_dotenv
+
+from document_extraction import save_upload, extract_text_async
+
+# Extracted document text on disk, keyed by the SHA-256 of the uploaded bytes
+# (the doc_id). Re-uploading the same file, or asking another question about
+# it by doc_id, reuses the stored text instead of parsing the file again.
+load_dotenv()
+DOCUMENT_CACHE_DIR = os.getenv("DOCUMENT_CACHE_DIR", "document_cache")
+DOCUMENT_CACHE_MAX_BYTES = int(os.getenv("DOCUMENT_CACHE_MAX_BYTES", str(500 * 1024 * 1024)))
+DOCUMENT_MAX_CHARS = int(os.getenv("DOCUMENT_MAX_CHARS", "200000"))  # extraction stops here; reported as truncated
+
+DOC_ID = re.compile(r"^[0-9a-f]{64}$")
+
+
+class DocumentStore:
+    """Text files in a directory, evicted least recently used first once over max_bytes."""
+
+    def __init__(self, path=DOCUMENT_CACHE_DIR, max_bytes=DOCUMENT_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, doc_id):
+        if not DOC_ID.match(doc_id):
+            raise ValueError("Invalid doc_id")
+        return os.path.join(self.path, f"{doc_id}.txt")
+
+    def get(self, doc_id):
+        """Stored text, or None. Marks the document as recently used."""
+        path = self._file(doc_id)
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                text = file.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return text
+
+    def put(self, doc_id, text):
+        path = self._file(doc_id)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            file.write(text)
+        os.replace(temp_path, path)  # readers never see a half-written file
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.path):
+                if entry.name.endswith(".txt"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    return
+                try:
+                    os.remove(path)
+                    total -= size
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        sizes = [entry.stat().st_size for entry in os.scandir(self.path) if entry.name.endswith(".txt")]
+        return {"documents": len(sizes), "bytes": sum(sizes), "max_bytes": self.max_bytes}
+
+
+document_store = DocumentStore()
+
+
+def is_truncated(text):
+    """Whether extraction stopped at DOCUMENT_MAX_CHARS, i.e. the end of the document is missing."""
+    return len(text) >= DOCUMENT_MAX_CHARS
+
+
+async def ingest_upload(upload):
+    """Store an UploadFile's text and return (doc_id, text); identical bytes are only extracted once."""
+    temp_path, doc_id = await save_upload(upload)
+    try:
+        text = await asyncio.to_thread(document_store.get, doc_id)
+        if text is not None:
+            return doc_id, text
+        start = time.perf_counter()
+        text = await extract_text_async(temp_path, max_chars=DOCUMENT_MAX_CHARS)
+        logging.info(f"Extracted {len(text)} chars for {doc_id[:12]} in {time.perf_counter() - start:.2f}s")
+        await asyncio.to_thread(document_store.put, doc_id, text)
+        return doc_id, text
+    finally:
+        os.remove(temp_path)
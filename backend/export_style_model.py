@@ -0,0 +1,50 @@
+"""Merge the thinking-style LoRA adapter into phi-2 and save a single safetensors model.
+
+apomind loads the merged model (memory-mapped) instead of rebuilding the
+PEFT stack on every start whenever STYLE_MERGED_MODEL_PATH exists.
+
+Usage:
+    python export_style_model.py --out ./style-model-merged [--dtype bf16]
+"""
+import os
+import json
+import time
+import argparse
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+from peft import PeftModel
+
+import apomind
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base", default=apomind.model_name)
+    parser.add_argument("--adapter", default=apomind.ADAPTER_PATH)
+    parser.add_argument("--out", default=apomind.MERGED_MODEL_PATH)
+    parser.add_argument("--dtype", choices=["fp32", "bf16", "fp16"], default="fp32",
+                        help="Weight dtype of the saved model (int8 is applied at load time via STYLE_CPU_DTYPE)")
+    args = parser.parse_args()
+
+    dtype = {"fp32": torch.float32, "bf16": torch.bfloat16, "fp16": torch.float16}[args.dtype]
+    start = time.perf_counter()
+
+    # Merge in full precision on CPU; 4-bit weights cannot be merged back losslessly
+    base = AutoModelForCausalLM.from_pretrained(args.base, torch_dtype=torch.float32,
+                                                trust_remote_code=True, low_cpu_mem_usage=True)
+    model = PeftModel.from_pretrained(base, args.adapter, is_trainable=False).merge_and_unload()
+    model = model.to(dtype)
+    model.save_pretrained(args.out, safe_serialization=True)
+
+    tokenizer = AutoTokenizer.from_pretrained(args.base, trust_remote_code=True, use_fast=False)
+    tokenizer.save_pretrained(args.out)
+
+    with open(os.path.join(args.out, "export_info.json"), "w") as f:
+        json.dump({"base": args.base, "adapter": args.adapter, "dtype": args.dtype,
+                   "exported_at": time.strftime("%Y-%m-%dT%H:%M:%S")}, f, indent=2)
+
+    print(f"Merged model written to {args.out} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
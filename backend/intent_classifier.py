@@ -0,0 +1,179 @@
+import os
+import re
+import json
+import zlib
+import random
+import logging
+import numpy as np
+from dotenv import load_dotenv
+
+# Local hashed n-gram classifier for the /chat/ intent labels.
+# get_question_data only falls back to OpenRouter when this model is missing
+# or not confident enough.
+load_dotenv()
+MODEL_PATH = os.getenv("INTENT_MODEL_PATH", "intent_model.npz")
+LABEL_LOG_PATH = os.getenv("INTENT_LABEL_LOG_PATH", "intent_labels.jsonl")
+CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.8"))
+# Share of confident local predictions still sent to OpenRouter, so the label log
+# keeps getting examples of every class instead of only what the model already predicts
+AUDIT_RATE = float(os.getenv("INTENT_AUDIT_RATE", "0.05"))
+
+LABELS = ["Optimisation", "Doubt", "Exploration", "Risk Taking"]
+N_FEATURES = 2 ** 18
+
+_TOKEN_RE = re.compile(r"[a-z0-9']+")
+_model = None
+_model_mtime = None
+
+
+def _hash(feature):
+    return zlib.crc32(feature.encode("utf-8")) % N_FEATURES
+
+
+def featurize(text):
+    """Return (indices, values) of the L2-normalised hashed n-gram vector for `text`."""
+    text = text.lower()
+    tokens = _TOKEN_RE.findall(text)
+    features = [f"w:{t}" for t in tokens]
+    features += [f"b:{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    padded = f" {' '.join(tokens)} "
+    features += [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+
+    counts = {}
+    for feature in features:
+        idx = _hash(feature)
+        counts[idx] = counts.get(idx, 0.0) + 1.0
+    if not counts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+    indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    values = np.log1p(values)
+    values /= np.linalg.norm(values)
+    return indices, values
+
+
+def _softmax(z):
+    z = z - z.max(axis=-1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+class IntentModel:
+    """Multinomial logistic regression over hashed features."""
+
+    def __init__(self, weights, bias, labels):
+        self.weights = weights
+        self.bias = bias
+        self.labels = list(labels)
+
+    def predict_proba(self, text):
+        indices, values = featurize(text)
+        logits = self.bias + values @ self.weights[indices]
+        return _softmax(logits)
+
+    def predict(self, text):
+        probs = self.predict_proba(text)
+        best = int(probs.argmax())
+        return self.labels[best], float(probs[best])
+
+    def save(self, path):
+        np.savez_compressed(path, weights=self.weights, bias=self.bias, labels=np.array(self.labels))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data["weights"], data["bias"], [str(label) for label in data["labels"]])
+
+
+def train(texts, labels, epochs=20, lr=0.5, l2=1e-5, seed=42):
+    """Fit an IntentModel with plain SGD on hashed features.
+
+    The model always covers every label in LABELS; training refuses to run
+    unless each one has examples, since a missing class would never be
+    predicted (and never sent to OpenRouter to be learned).
+    """
+    missing = [label for label in LABELS if label not in set(labels)]
+    if missing:
+        raise ValueError(f"No training examples for: {', '.join(missing)}")
+    label_set = list(LABELS)
+    label_to_idx = {label: i for i, label in enumerate(label_set)}
+    y = np.array([label_to_idx[label] for label in labels])
+    feats = [featurize(text) for text in texts]
+
+    weights = np.zeros((N_FEATURES, len(label_set)), dtype=np.float32)
+    bias = np.zeros(len(label_set), dtype=np.float32)
+    rng = np.random.default_rng(seed)
+
+    for epoch in range(epochs):
+        step = lr / (1 + epoch)
+        for i in rng.permutation(len(feats)):
+            indices, values = feats[i]
+            probs = _softmax(bias + values @ weights[indices])
+            grad = probs
+            grad[y[i]] -= 1.0
+            weights[indices] -= step * (np.outer(values, grad) + l2 * weights[indices])
+            bias -= step * grad
+
+    return IntentModel(weights, bias, label_set)
+
+
+def load_model():
+    """Load (or reload, if the file changed) the trained model; None if absent."""
+    global _model, _model_mtime
+    try:
+        mtime = os.path.getmtime(MODEL_PATH)
+    except OSError:
+        return None
+    if _model is None or mtime != _model_mtime:
+        try:
+            model = IntentModel.load(MODEL_PATH)
+            if sorted(model.labels) != sorted(LABELS):
+                logging.error(f"Ignoring intent model {MODEL_PATH}: labels {model.labels} != {LABELS}")
+                return None
+            _model = model
+            _model_mtime = mtime
+            logging.info(f"Loaded intent model from {MODEL_PATH}")
+        except Exception as e:
+            logging.error(f"Could not load intent model: {str(e)}")
+            return None
+    return _model
+
+
+def classify_local(text):
+    """Return (label, confidence) from the local model, or (None, 0.0) without one."""
+    model = load_model()
+    if model is None:
+        return None, 0.0
+    return model.predict(text)
+
+
+def should_audit():
+    """True for the AUDIT_RATE share of confident predictions that go to OpenRouter anyway."""
+    return random.random() < AUDIT_RATE
+
+
+def log_label(text, label):
+    """Append a remotely produced label to the training log."""
+    if label not in LABELS:
+        return
+    try:
+        with open(LABEL_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"text": text, "label": label}) + "\n")
+    except OSError as e:
+        logging.error(f"Could not log intent label: {str(e)}")
+
+
+def read_labels(path):
+    """Read a JSONL file of {"text", "label"} rows."""
+    texts, labels = [], []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+            if row.get("label") in LABELS and row.get("text"):
+                texts.append(row["text"])
+                labels.append(row["label"])
+    return texts, labels
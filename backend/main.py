@@ -1,18 +1,29 @@
 from fastapi import FastAPI, HTTPException, File, UploadFile, Form,Query , Body
 from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+import json
+import math
+import asyncio
 import logging
 import os
-import requests
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
-from pypdf import PdfReader
-from docx import Document
-import shutil
-from supabase import create_client, Client
 from passlib.context import CryptContext
-from recomendation import fetch_data, career_recommendation
-
-from apomind import generate_thinking_style
+from recomendation import fetch_data, career_recommendation, get_recommendations, invalidate_recommendations, invalidate_recommendations_many, current_version, ARTIFACT_DIR
+from intent_classifier import classify_local, log_label, should_audit, CONFIDENCE_THRESHOLD, LABELS
+from chat_persistence import chat_writer
+from style_updates import style_updates
+from style_jobs import StyleJobQueue, STYLE_JOB_BATCH_SIZE
+from conversation_store import conversations
+from document_extraction import shutdown_pool, UploadTooLarge
+from document_store import document_store, ingest_upload, is_truncated
+from document_index import document_context
+from response_cache import response_cache
+from openrouter_client import chat_completion, stream_chat_completion, close_client, OpenRouterError, single_flight_stats
+from upstream_governor import governor
+
+import style_client
+from style_client import infer_thinking_style_batch
 max_style="None"
 
 
@@ -29,8 +40,8 @@ print("SUPABASE_KEY:", os.getenv("SUPABASE_KEY"))
 # Initialize FastAPI App
 app = FastAPI()
 
-# Initialize Supabase Client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Shared Supabase client (db.py owns the only one)
+from db import supabase, get_user_ts, get_selection_username, chat_turn_rows, STYLE_KEYS, profile_cache
 
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -45,6 +56,59 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+
+@app.on_event("startup")
+async def start_chat_writer():
+    chat_writer.start()
+
+def refresh_recommendations(updates):
+    # One DELETE per flush, not one per user
+    invalidate_recommendations_many(update["username"] for update in updates)
+
+@app.on_event("startup")
+async def start_style_updates():
+    style_updates.on_flush(refresh_recommendations)
+    style_updates.start()
+
+@app.on_event("startup")
+async def check_recommender():
+    if current_version() is None:
+        logging.warning(f"No recommender artifact in {ARTIFACT_DIR}; the first /career_recommendation miss "
+                        "will train one. Run train_recommender.py before deploying to avoid that.")
+
+@app.on_event("startup")
+async def warm_up_models():
+    # Load the style model in the background so startup is not blocked on it
+    if os.getenv("STYLE_MODEL_WARMUP", "1") == "1":
+        style_client.warm_up()
+
+@app.on_event("shutdown")
+async def shutdown_clients():
+    await chat_writer.stop()  # flush queued chat_history rows before exiting
+    await asyncio.to_thread(style_jobs.stop)  # finish queued style jobs
+    await style_updates.stop()  # and pending user_ts increments
+    await close_client()
+    shutdown_pool()
+
+@app.get("/ready")
+async def readiness():
+    """Readiness probe: 200 once the thinking-style model is loaded, 503 until then."""
+    status = await asyncio.to_thread(style_client.status)
+    if not status["ready"]:
+        raise HTTPException(status_code=503, detail=status)
+    return status
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters for the tutor response cache, the user_ts profile cache and OpenRouter single-flight."""
+    return {"responses": response_cache.stats(), "profiles": profile_cache.stats(),
+            "single_flight": single_flight_stats(), "tutor_in_flight": len(_tutor_in_flight)}
+
+@app.get("/upstream/stats")
+async def upstream_stats():
+    """OpenRouter governor state: active calls, rejections, retries and the circuit breaker."""
+    return governor.stats()
+
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -102,7 +166,8 @@ async def get_career_recommendations(username: str = Query(..., description="Use
     API endpoint to get top 5 career recommendations for a given username.
     """
     try:
-        recommendations = career_recommendation(username)
+        # A miss reads Supabase and runs the GCN; keep it off the event loop
+        recommendations = await asyncio.to_thread(get_recommendations, username)
         if not recommendations:
             raise HTTPException(status_code=404, detail="No recommendations found for the user.")
         return recommendations
@@ -155,6 +220,7 @@ async def save_selected_courses(course_selection: CourseSelection):
         }).execute()
 
         print("response:", response)
+        invalidate_recommendations(username)
 
         if response.data:
             return {"message": "Courses saved successfully"}
@@ -211,99 +277,85 @@ async def login(user: UserLogin):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
-# Chat history (stores user & assistant messages)
-chat_history = []
-
 class ChatRequest(BaseModel):
     message: str
     user_id: int
+    stream: bool = False
 
 
-def update_thinking_style(user_id, user_message, category):
-    """Check Supabase for existing thinking style, if missing, run model and store result."""
-    
-    user_response = supabase.table("user_subject_sel").select("username").eq("id", user_id).execute()
-    if not user_response.data:
-        raise ValueError(f"User {user_id} not found in user_subject_sel")
-
-    username = user_response.data[0]["username"]  # Extract username
-
-    # ✅ Only call LLM when category is "Exploration"
-    if category == "Exploration":
-        peft_model_output = generate_thinking_style(user_message)  # Call the LLM model
-    else:
-        peft_model_output = {"concrete": 0, "logical": 0, "theoretical": 0, "practical": 0, "intuitive": 0}
-
-    # ✅ Extract dominant thinking style
-    thinking_styles = ["concrete", "logical", "theoretical", "practical", "intuitive"]
-    max_style = max(thinking_styles, key=lambda style: peft_model_output.get(style, 0))  
-
-    print("Checking existing entry in Supabase...")
+def upstream_error(error):
+    """HTTPException for a failed OpenRouter call: 503 + Retry-After when it is busy or down."""
+    if error.status_code in (429, 503):
+        retry_after = str(max(1, math.ceil(error.retry_after or 1)))
+        return HTTPException(status_code=503, detail="AI service is busy, please retry",
+                             headers={"Retry-After": retry_after})
+    return HTTPException(status_code=500, detail="API Error")
 
-    # ✅ Check if user_id already exists
-    existing_entry = supabase.table("user_ts").select("*").eq("id", user_id).execute()
+def stream_reply(payload, on_complete=None):
+    """Forward OpenRouter deltas to the client as Server-Sent Events.
 
-    if existing_entry.data:
-        print("User already exists, applying weighted update...")
-        existing_data = existing_entry.data[0]  # Get the existing record
-
-        # ✅ Apply weighted update: old_value + 0.15 * new_value
-        updated_values = {
-            "username": username,
-            "concrete": int(float(existing_data["concrete"]) + (0.15 * peft_model_output["concrete"])),
-            "logical": int(float(existing_data["logical"]) + (0.15 * peft_model_output["logical"])),
-            "theoretical": int(float(existing_data["theoretical"]) + (0.15 * peft_model_output["theoretical"])),
-            "practical": int(float(existing_data["practical"]) + (0.15 * peft_model_output["practical"])),
-            "intuitive": int(float(existing_data["intuitive"]) + (0.15 * peft_model_output["intuitive"])),
-            "timestamp": "now()"
-        }
-
-        # ✅ Update the existing record
-        supabase.table("user_ts").update(updated_values).eq("id", user_id).execute()
-
-    else:
-        print("Inserting new record...")
-        # ✅ Insert if the user does not exist
-        supabase.table("user_ts").insert([{
-            "id": user_id,
-            "username": username,
-            "concrete": peft_model_output["concrete"],
-            "logical": peft_model_output["logical"],
-            "theoretical": peft_model_output["theoretical"],
-            "practical": peft_model_output["practical"],
-            "intuitive": peft_model_output["intuitive"],
-            "timestamp": "now()"
-        }]).execute()
-    
-    return max_style  # ✅ Return stored thinking style
+    The assembled reply is passed to `on_complete` once the stream finishes.
+    """
+    async def events():
+        parts = []
+        try:
+            async for delta in stream_chat_completion(payload):
+                parts.append(delta)
+                yield f"data: {json.dumps({'delta': delta})}\n\n"
+        except OpenRouterError as e:
+            logging.error(f"Streaming completion failed: {str(e)}")
+            yield "event: error\ndata: API Error\n\n"
+            return
+        if on_complete:
+            on_complete("".join(parts))
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def stream_text(text):
+    """An already known reply (e.g. a cache hit) in the same SSE format as stream_reply."""
+    async def events():
+        yield f"data: {json.dumps({'delta': text})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def style_username(user_id):
+    """Username for user_ts updates; user_ts already carries it, only new users need user_subject_sel."""
+    existing_data = get_user_ts(user_id)
+    username = existing_data["username"] if existing_data and existing_data.get("username") else get_selection_username(user_id)
+    if not username:
+        raise ValueError(f"User {user_id} not found in user_subject_sel")
+    return username
 
-    import requests
 
-def get_question_data(user_message):
-    """Classify user message into Decision Making, Risk Taking, or Exploration using OpenRouter AI."""
-    API_KEY = os.getenv("OPENROUTER_API_KEY")
-    BASE_URL = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1")
+async def get_question_data(user_message):
+    """Classify user message into one of LABELS (Optimisation, Doubt, Exploration, Risk Taking)."""
+    # Use the local classifier when it is confident; OpenRouter is only the fallback
+    local_category, confidence = classify_local(user_message)
+    confident = local_category and confidence >= CONFIDENCE_THRESHOLD
+    if confident and not should_audit():
+        return local_category
 
     if not API_KEY:
+        if confident:
+            return local_category
         raise ValueError("Missing OpenRouter API Key")
 
     system_prompt = {
         "role": "system",
         "content": """
         You are an AI classifier. Your task is to analyze the user's input and classify it into one of four categories:
-        0. Optimisation-How user tries to solve or get a better solution or answer.
-        1. Doubt- User asks a subject specific doubt.
-        2. Decision Making – The user is contemplating multiple options and needs help choosing one.
-        3. Risk Taking – The user is considering actions that involve potential danger, uncertainty, or high stakes.
-        4. Optimisation-How user tries to solve or get a better solution or answer.
-        
-        Respond with only the category name.
-        """
-    }
+        1. Optimisation – How the user tries to solve a problem or get a better solution or answer.
+        2. Doubt – The user asks a subject specific doubt.
+        3. Exploration – The user is exploring a topic or contemplating multiple options and needs help choosing one.
+        4. Risk Taking – The user is considering actions that involve potential danger, uncertainty, or high stakes.
 
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
+        Respond with only the category name: Optimisation, Doubt, Exploration or Risk Taking.
+        """
     }
 
     payload = {
@@ -313,18 +365,23 @@ def get_question_data(user_message):
         "temperature": 0.0
     }
 
-    response = requests.post(f"{BASE_URL}/chat/completions", json=payload, headers=headers)
-
-    if response.status_code != 200:
-        raise ValueError(f"API Error: {response.status_code} - {response.text}")
-
-    category = response.json()["choices"][0]["message"]["content"].strip()
-    valid_categories = ["Optimisation", "Risk Taking", "Exploration", "Doubt"]
-    return category if category in valid_categories else "Unknown"
-
-def user_doubt(id,message,cat):
-    response = supabase.table("user_ts") .select("*") .eq("id", id).limit(1).execute()
-    print("thinking style:",response)
+    try:
+        category = (await chat_completion(payload)).strip()
+    except OpenRouterError as e:
+        if confident:
+            return local_category  # audit call only; the local answer is good enough
+        raise upstream_error(e)
+    # The prompt offers exactly LABELS, so the label log can cover every class the local model needs
+    if category not in LABELS:
+        return local_category if confident else "Unknown"
+    log_label(user_message, category)  # Training data for the local classifier
+    return category
+
+# "profile not passed"; None is a real value (the user has no user_ts row yet)
+_UNSET = object()
+
+def doubt_payload(id,message,profile=_UNSET):
+    response = get_user_ts(id) if profile is _UNSET else profile
     print("thinking style:",response)
     prompt = f"""
     You are an AI tutor guiding a student.
@@ -337,11 +394,6 @@ def user_doubt(id,message,cat):
     intuitive:use an analogy that is abstract and similar to current one
     User Input: {message}
     """
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
-    }
-
     payload = {
         "model": "mistralai/mistral-7b-instruct",
         "messages": [{"role": "system", "content": prompt}, {"role": "user", "content": message}],
@@ -349,17 +401,76 @@ def user_doubt(id,message,cat):
         "temperature": 0.3,
     }
 
-    response = requests.post(f"{BASE_URL}/chat/completions", json=payload, headers=headers)
+    return payload
 
-    if response.status_code != 200:
-        raise HTTPException(status_code=500, detail="API Error")
+def dominant_style(user_ts):
+    """Highest-scoring thinking style in a user_ts row, or None."""
+    if not user_ts:
+        return None
+    return max(STYLE_KEYS, key=lambda style: float(user_ts.get(style) or 0))
 
-    bot_response = response.json()["choices"][0]["message"]["content"]
-    return bot_response
+# Tutor answers being fetched, by response_cache key. The payload embeds the
+# user's profile, so OpenRouter single-flight cannot merge the same question
+# from different students; the cache key (style, category, question) can.
+_tutor_in_flight = {}
 
-def user_solve(id,message,cat):
-    response = supabase.table("user_ts") .select("*") .eq("id", id).limit(1).execute()
-    print("thinking style:",response)
+async def cached_tutor_answer(id, message, cat, build_payload, profile=_UNSET):
+    """Tutor answer from response_cache, else from OpenRouter (and cached).
+
+    Concurrent misses for the same cache key share one upstream call.
+    """
+    if profile is _UNSET:
+        profile = await asyncio.to_thread(get_user_ts, id)
+    style = dominant_style(profile)
+    # The similarity scan is CPU work; keep it off the event loop
+    bot_response = await asyncio.to_thread(response_cache.get, style, cat, message)
+    if bot_response is not None:
+        return bot_response
+
+    key = response_cache.key(style, cat, message)
+    future = _tutor_in_flight.get(key)
+    if future is None:
+        async def fetch():
+            reply = await chat_completion(build_payload(id, message, profile))
+            response_cache.set(style, cat, message, reply)
+            return reply
+
+        future = asyncio.ensure_future(fetch())
+        _tutor_in_flight[key] = future
+
+        def done(f):
+            _tutor_in_flight.pop(key, None)
+            if not f.cancelled():
+                f.exception()  # retrieved here so abandoned calls do not log "never retrieved"
+        future.add_done_callback(done)
+    try:
+        # One caller disconnecting must not cancel the call the others are waiting on
+        return await asyncio.shield(future)
+    except OpenRouterError as e:
+        raise upstream_error(e)
+
+async def stream_tutor_answer(id, message, cat, build_payload, profile=_UNSET):
+    if profile is _UNSET:
+        profile = await asyncio.to_thread(get_user_ts, id)
+    style = dominant_style(profile)
+    bot_response = await asyncio.to_thread(response_cache.get, style, cat, message)
+    if bot_response is not None:
+        return stream_text(bot_response)
+    # Join an identical question already being answered instead of asking again
+    future = _tutor_in_flight.get(response_cache.key(style, cat, message))
+    if future is not None:
+        try:
+            return stream_text(await asyncio.shield(future))
+        except OpenRouterError as e:
+            raise upstream_error(e)
+    return stream_reply(build_payload(id, message, profile),
+                        on_complete=lambda reply: response_cache.set(style, cat, message, reply))
+
+async def user_doubt(id,message,cat,profile=_UNSET):
+    return await cached_tutor_answer(id, message, cat, doubt_payload, profile)
+
+def solve_payload(id,message,profile=_UNSET):
+    response = get_user_ts(id) if profile is _UNSET else profile
     print("thinking style:",response)
     prompt = f"""
     You are an AI tutor guiding a student.
@@ -372,11 +483,6 @@ def user_solve(id,message,cat):
     intuitive:use an analogy that is abstract and similar to current one
     User Input: {message}
     """
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
-    }
-
     payload = {
         "model": "mistralai/mistral-7b-instruct",
         "messages": [{"role": "system", "content": prompt}, {"role": "user", "content": message}],
@@ -384,34 +490,64 @@ def user_solve(id,message,cat):
         "temperature": 0.3,
     }
 
-    response = requests.post(f"{BASE_URL}/chat/completions", json=payload, headers=headers)
+    return payload
 
-    if response.status_code != 200:
-        raise HTTPException(status_code=500, detail="API Error")
+async def user_solve(id,message,cat,profile=_UNSET):
+    return await cached_tutor_answer(id, message, cat, solve_payload, profile)
 
-    bot_response = response.json()["choices"][0]["message"]["content"]
-    return bot_response
 
+def run_style_job(user_id, messages):
+    """style_jobs handler: score the queued Exploration messages in batches and queue them as one update.
+
+    Returns the dominant style of the latest message.
+    """
+    username = style_username(user_id)
+    outputs = []
+    for start in range(0, len(messages), STYLE_JOB_BATCH_SIZE):
+        outputs.extend(infer_thinking_style_batch(messages[start:start + STYLE_JOB_BATCH_SIZE]))
+    if not outputs:
+        return None
+    style_updates.add_batch(user_id, username, outputs)
+    return max(STYLE_KEYS, key=lambda style: outputs[-1].get(style, 0))
+
+# ✅ Style inference runs on its own bounded worker pool, off the request path
+style_jobs = StyleJobQueue(run_style_job)
+
+@app.get("/style_jobs/{job_id}")
+async def style_job_status(job_id: str):
+    job = style_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 @app.post("/chat/")
 async def chat_endpoint(request: ChatRequest):
     """Process user query, classify it, and store response in Supabase."""
 
-    category = get_question_data(request.message)  # ✅ Classify input
+    # ✅ Classification and the user_ts read are independent, so run them together
+    category, profile = await asyncio.gather(
+        get_question_data(request.message),
+        asyncio.to_thread(get_user_ts, request.user_id),
+    )
     print("category" , category)
     
     if category=="Doubt":
-        bot_response=user_doubt(request.user_id, request.message, category)
+        if request.stream:
+            return await stream_tutor_answer(request.user_id, request.message, category, doubt_payload, profile)
+        bot_response=await user_doubt(request.user_id, request.message, category, profile)
         return {"reply": bot_response}
     
     if category=="Optimisation":
-        bot_response=user_solve(request.user_id, request.message, category)
+        if request.stream:
+            return await stream_tutor_answer(request.user_id, request.message, category, solve_payload, profile)
+        bot_response=await user_solve(request.user_id, request.message, category, profile)
         return {"reply": bot_response}
     
-    # ✅ Call thinking style function only for "Exploration"
-    user_thinking_style = None
+    # ✅ Reply with the last known thinking style; "Exploration" messages are queued for style inference
+    user_thinking_style = dominant_style(profile)
+    style_job = None
     if category == "Exploration":
-        user_thinking_style = update_thinking_style(request.user_id, request.message, category)
+        style_job = style_jobs.submit(request.user_id, request.message)
 
     # ✅ Construct the prompt
     prompt = f"""
@@ -423,11 +559,6 @@ async def chat_endpoint(request: ChatRequest):
     User Input: {request.message}
     """
 
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
-    }
-
     payload = {
         "model": "mistralai/mistral-7b-instruct",
         "messages": [{"role": "system", "content": prompt}, {"role": "user", "content": request.message}],
@@ -435,111 +566,139 @@ async def chat_endpoint(request: ChatRequest):
         "temperature": 0.3,
     }
 
-    response = requests.post(f"{BASE_URL}/chat/completions", json=payload, headers=headers)
-
-    if response.status_code != 200:
-        raise HTTPException(status_code=500, detail="API Error")
+    def store_chat(bot_response):
+        # ✅ Queue both messages for a background bulk insert
+        chat_writer.enqueue(chat_turn_rows(request.user_id, request.message, bot_response))
 
-    bot_response = response.json()["choices"][0]["message"]["content"]
+    if request.stream:
+        response = stream_reply(payload, on_complete=store_chat)
+        if style_job:
+            response.headers["X-Style-Job-Id"] = style_job.id
+        return response
 
-    # ✅ Store responses in Supabase
-    supabase.table("chat_history").insert([
-        {"uid": request.user_id, "role": "user", "message": request.message}
-    ]).execute()
+    try:
+        bot_response = await chat_completion(payload)
+    except OpenRouterError as e:
+        raise upstream_error(e)
 
-    supabase.table("chat_history").insert([
-        {"uid": request.user_id, "role": "bot", "message": bot_response}
-    ]).execute()
+    store_chat(bot_response)
 
+    if style_job:
+        return {"reply": bot_response, "style_job_id": style_job.id}
     return {"reply": bot_response}
 
 
-def extract_text_from_file(file_path):
-    """Extract text from a file (TXT, PDF, DOCX)"""
-    if file_path.endswith(".txt"):
-        with open(file_path, "r", encoding="utf-8") as file:
-            return file.read()
-    elif file_path.endswith(".pdf"):
-        reader = PdfReader(file_path)
-        return "\n".join([page.extract_text() for page in reader.pages if page.extract_text()])
-    elif file_path.endswith(".docx"):
-        doc = Document(file_path)
-        return "\n".join([para.text for para in doc.paragraphs])
-    else:
-        raise ValueError("Unsupported file type. Use TXT, PDF, or DOCX.")
+async def answer_document(user_id, question, document_text, doc_id, stream=False):
+    """Answer a question about document text, continuing the user's conversation.
 
-@app.post("/upload/")
-async def upload_file(file: UploadFile = File(...), question: str = Form(...), user_id: int = Form(...)):
-    """Handles file uploads and generates AI responses based on file content + user question."""
-    if not API_KEY:
-        raise HTTPException(status_code=500, detail="Missing API Key")
+    `truncated` in the reply (X-Doc-Truncated when streaming) says the text was cut at DOCUMENT_MAX_CHARS.
+    """
+    truncated = is_truncated(document_text)
+    # Only the chunks relevant to the question (BM25), within a fixed token budget
+    document_excerpts = await asyncio.to_thread(document_context, doc_id, document_text, question)
 
-    # Save file temporarily
-    temp_file_path = f"temp_{file.filename}"
-    with open(temp_file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Define system prompt for file analysis
+    system_prompt = {
+        "role": "system",
+        "content": f"""
+        You are an AI assistant analyzing a document.
+        The user uploaded a file and has a question related to it.
+        Your goal is to:
+        1. Read and understand the document.
+        2. Answer the user's question based on the document.
+        3. Provide additional insights if relevant.
+
+        Relevant excerpts from the document:
+        {document_excerpts}
+        """
+    }
 
-    try:
-        # Extract text from uploaded file
-        extracted_text = extract_text_from_file(temp_file_path)
-        truncated_text = extracted_text[:4000]
-
-        # Define system prompt for file analysis
-        system_prompt = {
-            "role": "system",
-            "content": f"""
-            You are an AI assistant analyzing a document.
-            The user uploaded a file and has a question related to it.
-            Your goal is to:
-            1. Read and understand the document.
-            2. Answer the user's question based on the document.
-            3. Provide additional insights if relevant.
-
-            Document Content:
-            {truncated_text}
-            """
-        }
+    # This user's recent conversation, trimmed to the history token budget
+    messages = await asyncio.to_thread(conversations.build_messages, user_id, system_prompt, question)
 
-        # Append file question to chat history
-        chat_history.append({"role": "user", "content": question})
+    payload = {
+        "model": "mistralai/mistral-7b-instruct",
+        "messages": messages,
+        "max_tokens": 500,
+        "temperature": 0.3,
+    }
 
-        headers = {
-            "Authorization": f"Bearer {API_KEY}",
-            "Content-Type": "application/json"
-        }
+    def store_chat(bot_response):
+        # Append the turn to this user's conversation
+        conversations.append(user_id, {"role": "user", "content": question},
+                             {"role": "assistant", "content": bot_response})
 
-        payload = {
-            "model": "mistralai/mistral-7b-instruct",
-            "messages": [system_prompt] + chat_history,
-            "max_tokens": 500,
-            "temperature": 0.3,
-        }
+        # Store the user file query & bot response in Supabase chat_history
+        chat_writer.enqueue(chat_turn_rows(user_id, question, bot_response))
 
-        response = requests.post(f"{BASE_URL}/chat/completions", json=payload, headers=headers)
+    if stream:
+        response = stream_reply(payload, on_complete=store_chat)
+        response.headers["X-Doc-Id"] = doc_id
+        response.headers["X-Doc-Truncated"] = "true" if truncated else "false"
+        return response
 
-        if response.status_code != 200:
-            raise HTTPException(status_code=500, detail="API Error")
+    try:
+        bot_response = await chat_completion(payload)
+    except OpenRouterError as e:
+        raise upstream_error(e)
 
-        bot_response = response.json()["choices"][0]["message"]["content"]
+    store_chat(bot_response)
 
-        # Append AI response to chat history
-        chat_history.append({"role": "assistant", "content": bot_response})
+    return {"reply": bot_response, "doc_id": doc_id, "truncated": truncated}
 
-        # Store the user file query & bot response in Supabase chat_history
-        supabase.table("chat_history").insert([
-            {"uid": user_id, "role": "user", "message": question}
-        ]).execute()
+async def ingest_or_raise(file):
+    try:
+        return await ingest_upload(file)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        supabase.table("chat_history").insert([
-            {"uid": user_id, "role": "bot", "message": bot_response}
-        ]).execute()
+@app.post("/upload/")
+async def upload_file(file: UploadFile = File(...), question: str = Form(...), user_id: int = Form(...),
+                      stream: bool = Form(False)):
+    """Handles file uploads and generates AI responses based on file content + user question."""
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="Missing API Key")
 
-        return {"reply": bot_response}
+    # Identical files are only extracted once (content-hash cache)
+    doc_id, document_text = await ingest_or_raise(file)
 
+    try:
+        return await answer_document(user_id, question, document_text, doc_id, stream)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-        
 
-    finally:
-        # Cleanup: Remove temporary file
-        os.remove(temp_file_path)
\ No newline at end of file
+@app.post("/documents/")
+async def upload_document(file: UploadFile = File(...)):
+    """Store a document's text and return its doc_id for later questions."""
+    doc_id, document_text = await ingest_or_raise(file)
+    return {"doc_id": doc_id, "chars": len(document_text), "truncated": is_truncated(document_text)}
+
+class DocumentQuestion(BaseModel):
+    question: str
+    user_id: int
+    stream: bool = False
+
+@app.post("/documents/{doc_id}/ask")
+async def ask_document(doc_id: str, request: DocumentQuestion):
+    """Ask about a previously uploaded document without re-sending it."""
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="Missing API Key")
+    try:
+        document_text = await asyncio.to_thread(document_store.get, doc_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if document_text is None:
+        raise HTTPException(status_code=404, detail="Document not found, upload it again")
+
+    try:
+        return await answer_document(request.user_id, request.question, document_text, doc_id, request.stream)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,186 @@
+import os
+import json
+import asyncio
+import logging
+import httpx
+from dotenv import load_dotenv
+
+from upstream_governor import governor, parse_retry_after, UpstreamUnavailable
+
+# Shared async OpenRouter client used by every LLM call in main.py
+load_dotenv()
+API_KEY = os.getenv("OPENROUTER_API_KEY")
+BASE_URL = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1")
+
+CONNECT_TIMEOUT = float(os.getenv("OPENROUTER_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("OPENROUTER_READ_TIMEOUT", "60"))
+WRITE_TIMEOUT = float(os.getenv("OPENROUTER_WRITE_TIMEOUT", "10"))
+POOL_TIMEOUT = float(os.getenv("OPENROUTER_POOL_TIMEOUT", "10"))
+MAX_CONNECTIONS = int(os.getenv("OPENROUTER_MAX_CONNECTIONS", "200"))
+MAX_KEEPALIVE = int(os.getenv("OPENROUTER_MAX_KEEPALIVE", "50"))
+KEEPALIVE_EXPIRY = float(os.getenv("OPENROUTER_KEEPALIVE_EXPIRY", "30"))
+# Deterministic (temperature 0) calls are always coalesced; sampled ones only with this set
+SINGLE_FLIGHT_SAMPLED = os.getenv("OPENROUTER_SINGLE_FLIGHT_SAMPLED", "0") == "1"
+
+try:
+    import h2  # noqa: F401  (only needed for HTTP/2 support in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+_client = None
+_in_flight = {}  # rendered payload -> Future of the shared upstream call
+_single_flight_stats = {"leaders": 0, "followers": 0}
+
+
+class OpenRouterError(Exception):
+    """Raised when OpenRouter returns a non-200 response (503 also when the governor refuses the call)."""
+
+    def __init__(self, status_code, text, retry_after=None):
+        super().__init__(f"API Error: {status_code} - {text}")
+        self.status_code = status_code
+        self.text = text
+        self.retry_after = retry_after
+
+
+RETRYABLE = (OpenRouterError, httpx.TransportError)
+
+
+def get_client():
+    """Return the process-wide AsyncClient, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=BASE_URL,
+            http2=HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(CONNECT_TIMEOUT, read=READ_TIMEOUT,
+                                  write=WRITE_TIMEOUT, pool=POOL_TIMEOUT),
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS,
+                                max_keepalive_connections=MAX_KEEPALIVE,
+                                keepalive_expiry=KEEPALIVE_EXPIRY),
+        )
+        logging.info(f"OpenRouter client created (http2={HTTP2_AVAILABLE})")
+    return _client
+
+
+async def close_client():
+    """Close the shared client (called on app shutdown)."""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+
+def _headers():
+    if not API_KEY:
+        raise ValueError("Missing OpenRouter API Key")
+    return {
+        "Authorization": f"Bearer {API_KEY}",
+        "Content-Type": "application/json"
+    }
+
+
+def _status_error(response, text):
+    return OpenRouterError(response.status_code, text, parse_retry_after(response.headers.get("retry-after")))
+
+
+async def _post_once(payload):
+    response = await get_client().post("/chat/completions", json=payload, headers=_headers())
+
+    if response.status_code != 200:
+        raise _status_error(response, response.text)
+
+    return response.json()["choices"][0]["message"]["content"]
+
+
+async def _post_completion(payload):
+    """_post_once under the upstream governor (limits, retries, circuit breaker)."""
+    try:
+        return await governor.run(lambda: _post_once(payload), retry_on=RETRYABLE)
+    except UpstreamUnavailable as e:
+        raise OpenRouterError(503, str(e), e.retry_after)
+    except httpx.TransportError as e:
+        raise OpenRouterError(502, str(e)) from e
+
+
+async def chat_completion(payload, single_flight=None):
+    """POST a chat completion and return the assistant message content.
+
+    With single_flight, concurrent calls with an identical payload share one
+    upstream request and its result (or error). The default is on for
+    temperature 0 and OPENROUTER_SINGLE_FLIGHT_SAMPLED otherwise.
+    """
+    if single_flight is None:
+        single_flight = payload.get("temperature") == 0 or SINGLE_FLIGHT_SAMPLED
+    if not single_flight:
+        return await _post_completion(payload)
+
+    key = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    future = _in_flight.get(key)
+    if future is None:
+        _single_flight_stats["leaders"] += 1
+        future = asyncio.ensure_future(_post_completion(payload))
+        _in_flight[key] = future
+
+        def done(f):
+            _in_flight.pop(key, None)
+            if not f.cancelled():
+                f.exception()  # retrieved here so abandoned calls do not log "never retrieved"
+        future.add_done_callback(done)
+    else:
+        _single_flight_stats["followers"] += 1
+    # One caller disconnecting must not cancel the call the others are waiting on
+    return await asyncio.shield(future)
+
+
+def single_flight_stats():
+    return {**_single_flight_stats, "in_flight": len(_in_flight)}
+
+
+async def stream_chat_completion(payload):
+    """Yield content deltas from a `stream: true` chat completion as they arrive.
+
+    The governor slot is held for the whole stream; only failures before the
+    first delta are retried.
+    """
+    payload = {**payload, "stream": True}
+    attempt, waited = 0, 0.0
+    while True:
+        started = False
+        try:
+            async with governor.slot():
+                async with get_client().stream("POST", "/chat/completions", json=payload,
+                                               headers=_headers()) as response:
+                    if response.status_code != 200:
+                        text = (await response.aread()).decode("utf-8", "replace")
+                        raise _status_error(response, text)
+                    governor.record()
+
+                    async for line in response.aiter_lines():
+                        # SSE frames look like "data: {...}"; OpenRouter also sends ": keep-alive" comments
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            break
+                        try:
+                            delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                        except (json.JSONDecodeError, KeyError, IndexError):
+                            continue
+                        if delta:
+                            started = True
+                            yield delta
+                    return
+        except UpstreamUnavailable as e:
+            raise OpenRouterError(503, str(e), e.retry_after)
+        except RETRYABLE as e:
+            governor.record(e)
+            delay = None if started else governor.retry_delay(e, attempt, waited)
+            if delay is None:
+                if isinstance(e, httpx.TransportError):
+                    raise OpenRouterError(502, str(e)) from e
+                raise
+            logging.warning(f"OpenRouter stream failed ({str(e)}), retry {attempt + 1} in {delay:.1f}s")
+        await asyncio.sleep(delay)
+        attempt += 1
+        waited += delay
@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# Write-through cache for user_ts rows. By default entries live in a SQLite
+# file shared by every worker on the host (one file per Supabase project), so
+# an invalidation in one uvicorn worker is seen by all of them. Set
+# PROFILE_CACHE_DB to another path, or to "" for an in-process LRU that is
+# only coherent with a single worker.
+load_dotenv()
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "600"))
+_project = hashlib.sha1((os.getenv("SUPABASE_URL") or "").encode("utf-8")).hexdigest()[:12]
+PROFILE_CACHE_DB = os.getenv("PROFILE_CACHE_DB",
+                             os.path.join(tempfile.gettempdir(), f"apomind-profiles-{_project}.sqlite"))
+
+
+class ProfileCache:
+    """LRU + TTL cache keyed by user id.
+
+    With `path`, entries live in a SQLite table shared by every process on
+    the host; the size bound there evicts the least recently written rows.
+
+    Every invalidation bumps a per-key generation. A reader that takes
+    `token(key)` before going to the database and passes it to `set` will not
+    re-cache a row that was invalidated while it was being fetched.
+    """
+
+    def __init__(self, maxsize=PROFILE_CACHE_SIZE, ttl=PROFILE_CACHE_TTL, path=PROFILE_CACHE_DB):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self._entries = OrderedDict()
+        self._generations = OrderedDict()  # key -> generation of its last invalidation
+        self._counter = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        if path:
+            with self._connect() as conn:
+                conn.execute("create table if not exists profiles "
+                             "(id text primary key, row text not null, stored_at real not null)")
+                conn.execute("create table if not exists generations (id text primary key, gen integer not null)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("pragma journal_mode=wal")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        key = str(key)
+        now = time.time()
+        if self.path:
+            found = self._connect().execute("select row, stored_at from profiles where id = ?", (key,)).fetchone()
+            if found and now - found[1] < self.ttl:
+                self.hits += 1
+                return json.loads(found[0])
+            self.misses += 1
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def token(self, key):
+        """Current generation of `key`; pass it to `set` after a database read."""
+        key = str(key)
+        if self.path:
+            found = self._connect().execute("select gen from generations where id = ?", (key,)).fetchone()
+            return found[0] if found else 0
+        with self._lock:
+            return self._generations.get(key, 0)
+
+    def set(self, key, value, token=None):
+        """Store `value`; with `token`, only if `key` was not invalidated since the token was taken."""
+        key = str(key)
+        now = time.time()
+        if self.path:
+            conn = self._connect()
+            if token is None:
+                conn.execute("insert into profiles (id, row, stored_at) values (?, ?, ?) "
+                             "on conflict(id) do update set row = excluded.row, stored_at = excluded.stored_at",
+                             (key, json.dumps(value), now))
+            else:
+                conn.execute("insert into profiles (id, row, stored_at) select ?, ?, ? "
+                             "where coalesce((select gen from generations where id = ?), 0) = ? "
+                             "on conflict(id) do update set row = excluded.row, stored_at = excluded.stored_at",
+                             (key, json.dumps(value), now, key, token))
+            self._writes += 1
+            if self._writes % 100 == 0:
+                conn.execute("delete from profiles where id in (select id from profiles order by stored_at desc "
+                             "limit -1 offset ?)", (self.maxsize,))
+                conn.execute("delete from generations where id not in (select id from profiles) "
+                             "and id in (select id from generations order by gen desc limit -1 offset ?)",
+                             (self.maxsize,))
+            return
+
+        with self._lock:
+            if token is not None and self._generations.get(key, 0) != token:
+                return
+            self._entries[key] = (now, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        key = str(key)
+        if self.path:
+            conn = self._connect()
+            conn.execute("insert into generations (id, gen) values (?, 1) "
+                         "on conflict(id) do update set gen = gen + 1", (key,))
+            conn.execute("delete from profiles where id = ?", (key,))
+            return
+        with self._lock:
+            self._counter += 1
+            self._generations[key] = self._counter
+            self._generations.move_to_end(key)
+            while len(self._generations) > self.maxsize:
+                self._generations.popitem(last=False)
+            self._entries.pop(key, None)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "shared": bool(self.path)}
@@ -1,6 +1,11 @@
+import os
+import json
+import time
+import hashlib
+import threading
 import numpy as np
 import pandas as pd
-from supabase import create_client, Client
+from career_catalog import CatalogCache, split_subjects, normalize_styles
 import os
 from dotenv import load_dotenv
 import torch
@@ -11,31 +16,50 @@ import numpy as np
 
 # Load environment variables
 load_dotenv()
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
-# Initialize Supabase
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Shared Supabase client
+from db import supabase, get_user_ts, STYLE_KEYS
 
-def fetch_data(username):
-    """Fetch user-selected subjects, thinking styles, and careers."""
+def fetch_user_data(username):
+    """Fetch user-selected subjects and thinking styles."""
     try:
-        #print("=== 1 fd")
         user_subjects = supabase.table("user_subject_sel").select("*").eq("username", username).single().execute().data
-        #print("=== 2 fd")
-        careers = supabase.table("career").select("*").execute().data
-        ##print("=== 3 fd")
-        user_thinking_style = supabase.table("user_ts").select("concrete, logical, theoretical, practical, intuitive").eq("username", username).execute().data
-        #print("=== 4 fd")
-        #print(f"\nno1\n{user_subjects}\nno2\n{user_thinking_style}\nno3\n{careers}")
+        # Thinking style by id, so it comes from the shared profile cache
+        user_ts = get_user_ts(user_subjects["id"]) if user_subjects else None
+        user_thinking_style = [{key: user_ts[key] for key in STYLE_KEYS}] if user_ts else []
         return (
-            pd.DataFrame([user_subjects]) if user_subjects else pd.DataFrame(), 
-            pd.DataFrame([user_thinking_style]) if user_thinking_style else pd.DataFrame(), 
-            pd.DataFrame(careers) if careers else pd.DataFrame()
+            pd.DataFrame([user_subjects]) if user_subjects else pd.DataFrame(),
+            pd.DataFrame([user_thinking_style]) if user_thinking_style else pd.DataFrame()
         )
     except Exception as e:
         print(f"Error fetching data: {e}")
-        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+        return pd.DataFrame(), pd.DataFrame()
+
+def fetch_careers():
+    """Fetch the full career catalog."""
+    try:
+        careers = supabase.table("career").select("*").execute().data
+        return pd.DataFrame(careers) if careers else pd.DataFrame()
+    except Exception as e:
+        print(f"Error fetching careers: {e}")
+        return pd.DataFrame()
+
+# The career table changes rarely; keep it (and its precomputed arrays) in-process
+CAREER_CATALOG_TTL = float(os.getenv("CAREER_CATALOG_TTL", "300"))
+_catalog_cache = CatalogCache(fetch_careers, CAREER_CATALOG_TTL)
+
+def get_catalog(force=False):
+    """Cached CareerCatalog (None if the career table is empty)."""
+    return _catalog_cache.get(force=force)
+
+def invalidate_catalog():
+    _catalog_cache.invalidate()
+
+def fetch_data(username):
+    """Fetch user-selected subjects, thinking styles, and careers."""
+    user_subjects_df, user_ts_df = fetch_user_data(username)
+    catalog = get_catalog()
+    return user_subjects_df, user_ts_df, catalog.careers_df if catalog else pd.DataFrame()
 
 # def career_recommendation(username):
 #     """Recommend top 5 careers based on user-selected subjects and thinking style."""
@@ -103,48 +127,45 @@ from torch_geometric.nn import GCNConv
 import pandas as pd
 import numpy as np
 
-def build_graph(user_subjects_df, user_ts_df, careers_df):
-    """Constructs a graph from user subjects, thinking styles, and career data."""
-    node_features = []  # Feature matrix
-    edges = []  # Edge list
+HIDDEN_CHANNELS = 16
 
-    # Extract all subjects from career prerequisites safely
-    all_prereqs = careers_df['prerequisites'].dropna().astype(str).str.split(',').sum()
-    subject_list = list(set(all_prereqs))  # Unique subjects
-    subject_to_idx = {subj: i + 1 for i, subj in enumerate(subject_list)}  # Offset by 1 (0 is user)
+# Career/subject embeddings are trained offline by train_recommender.py;
+# serving only loads the newest artifact and runs one forward pass per user.
+ARTIFACT_DIR = os.getenv("RECOMMENDER_ARTIFACT_DIR", "recommender_artifacts")
+CURRENT_POINTER = "current.json"
 
-    # ✅ Ensure user_features is a list of floats
-    user_features = list(map(float, user_ts_df.iloc[0].values))
-    node_features.append(user_features)  # User node at index 0
+_artifact = None
+_artifact_lock = threading.Lock()
 
-    # Selected subject nodes (only those present in subject_list)
-    selected_subjects = set(user_subjects_df.iloc[0]['selected_subjects'].split(','))
-    valid_subjects = [subj for subj in selected_subjects if subj in subject_to_idx]
 
-    for subj in valid_subjects:
-        node_features.append([0.0] * len(user_features))  # Placeholder
-        edges.append((0, subject_to_idx[subj]))  # Connect user to subjects
+def standardize(matrix, stats):
+    mean, std = stats
+    return ((matrix - mean) / std).astype(np.float32)
 
-    # Career nodes
-    for idx, row in careers_df.iterrows():
-        # ✅ Ensure career features are numeric (fill missing with 0)
-        career_features = [float(row.get(col, 0.0)) for col in ['Concrete', 'Logical', 'Theoretical', 'Practical', 'Intuitive']]
-        node_features.append(career_features)
 
-        # Ensure prerequisites exist before connecting
-        prereqs = row.get('prerequisites', "")
-        if pd.isna(prereqs) or not isinstance(prereqs, str):
-            prereqs = []
-        else:
-            prereqs = [p.strip() for p in prereqs.split(',') if p.strip() in subject_to_idx]
+def build_catalog_graph(catalog):
+    """Subject and career nodes, with undirected subject–career prerequisite edges.
 
-        for prereq in prereqs:
-            edges.append((subject_to_idx[prereq], len(node_features) - 1))  # Subject → Career
+    Subjects are nodes 0..S-1 and careers S..S+C-1. A subject's features are
+    the mean style of the careers that require it. Style distributions are
+    standardized with the catalog's mean/std (returned as `stats`) so the
+    embeddings stay discriminative. Everything is derived from the catalog's
+    sparse incidence matrix.
+    """
+    incidence = catalog.incidence
+    num_subjects = incidence.shape[0]
+    subject_counts = np.asarray(incidence.sum(axis=1)).ravel()
+    subject_features = np.asarray(incidence @ catalog.styles) / np.maximum(subject_counts, 1)[:, None]
 
-    edge_index = torch.tensor(edges, dtype=torch.long).t().contiguous()
-    x = torch.tensor(node_features, dtype=torch.float)
+    stats = (catalog.styles.mean(axis=0), catalog.styles.std(axis=0) + 1e-6)
+    subject_features = standardize(subject_features, stats)
+    career_features = standardize(catalog.styles, stats)
 
-    return Data(x=x, edge_index=edge_index)
+    coo = incidence.tocoo()
+    src, dst = coo.row, coo.col + num_subjects
+    edge_index = torch.tensor(np.vstack([np.concatenate([src, dst]), np.concatenate([dst, src])]), dtype=torch.long)
+    x = torch.tensor(np.vstack([subject_features, career_features]), dtype=torch.float)
+    return Data(x=x, edge_index=edge_index), subject_features, stats
 
 class GNNRecommender(torch.nn.Module):
     def __init__(self, in_channels, hidden_channels, out_channels):
@@ -159,10 +180,154 @@ class GNNRecommender(torch.nn.Module):
         x = self.conv2(x, edge_index)
         return x
 
-def career_recommendation(username):
-    user_subjects_df, user_ts_df, careers_df = fetch_data(username)
 
-    if user_subjects_df.empty or user_ts_df.empty or careers_df.empty:
+def train_recommender(catalog, epochs=200, lr=0.01, seed=42):
+    """Train the GCN on the career catalog once and return a serializable artifact."""
+    torch.manual_seed(seed)
+    data, subject_features, stats = build_catalog_graph(catalog)
+    subject_to_idx = catalog.subject_to_idx
+    in_channels = data.x.shape[1]
+    model = GNNRecommender(in_channels, HIDDEN_CHANNELS, in_channels)
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+
+    model.train()
+    for epoch in range(epochs):
+        optimizer.zero_grad()
+        out = model(data)
+        loss = F.mse_loss(out, data.x)
+        loss.backward()
+        optimizer.step()
+
+    model.eval()
+    with torch.no_grad():
+        career_embeddings = model(data)[len(subject_to_idx):]
+
+    return {
+        "version": catalog.version,
+        "trained_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "loss": float(loss.item()),
+        "channels": (in_channels, HIDDEN_CHANNELS, in_channels),
+        "state_dict": model.state_dict(),
+        "subject_to_idx": subject_to_idx,
+        "subject_features": torch.tensor(subject_features),
+        "feature_mean": stats[0],
+        "feature_std": stats[1],
+        "career_ids": catalog.career_ids,
+        "career_names": catalog.career_names,
+        "career_embeddings": career_embeddings,
+    }
+
+
+def artifact_path(version):
+    return os.path.join(ARTIFACT_DIR, f"recommender-{version}.pt")
+
+
+def save_artifact(artifact):
+    """Write a versioned artifact and point current.json at it."""
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    path = artifact_path(artifact["version"])
+    torch.save(artifact, path)
+    with open(os.path.join(ARTIFACT_DIR, CURRENT_POINTER), "w") as f:
+        json.dump({"version": artifact["version"], "path": os.path.basename(path)}, f)
+    return path
+
+
+def current_version():
+    try:
+        with open(os.path.join(ARTIFACT_DIR, CURRENT_POINTER)) as f:
+            return json.load(f)["version"]
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def artifact_version():
+    """Version of the artifact this process serves, without loading it; None if there is none yet."""
+    return _artifact["version"] if _artifact is not None else current_version()
+
+
+def load_artifact():
+    """Load the current artifact once per process (model included).
+
+    Without one (train_recommender.py never ran), trains and saves one on the
+    spot, so a fresh deploy still serves recommendations.
+    """
+    global _artifact
+    if _artifact is not None:
+        return _artifact
+    with _artifact_lock:
+        if _artifact is None:
+            version = current_version()
+            if version is None:
+                print(f"No recommender artifact in {ARTIFACT_DIR}; training one now "
+                      "(run train_recommender.py to do this offline)")
+                catalog = get_catalog(force=True)
+                if catalog is None:
+                    raise FileNotFoundError("Career catalog is empty; cannot train the recommender")
+                save_artifact(train_recommender(catalog))
+                version = current_version()
+            artifact = torch.load(artifact_path(version), weights_only=False)
+            model = GNNRecommender(*artifact["channels"])
+            model.load_state_dict(artifact["state_dict"])
+            model.eval()
+            artifact["model"] = model
+            artifact["career_embeddings_norm"] = F.normalize(artifact["career_embeddings"], dim=1)
+            _artifact = artifact
+            print(f"Loaded recommender artifact {version}")
+    return _artifact
+
+
+@torch.no_grad()
+def embed_users(artifact, user_features, user_subjects):
+    """Embed users with one forward pass of the trained GCN.
+
+    The graph holds the catalog's subject nodes plus one node per user; each
+    user only receives messages from its selected subjects, so users do not
+    affect each other and any number of them can share the pass.
+    """
+    subject_to_idx = artifact["subject_to_idx"]
+    num_subjects = len(subject_to_idx)
+    edges = [(subject_to_idx[subj], num_subjects + u)
+             for u, subjects in enumerate(user_subjects) for subj in subjects if subj in subject_to_idx]
+
+    x = torch.cat([artifact["subject_features"],
+                   torch.tensor(standardize(normalize_styles(user_features),
+                                            (artifact["feature_mean"], artifact["feature_std"])))])
+    edge_index = torch.tensor(edges, dtype=torch.long).t().contiguous() if edges else torch.empty((2, 0), dtype=torch.long)
+    return artifact["model"](Data(x=x, edge_index=edge_index))[num_subjects:]
+
+
+def score_users(artifact, user_features, user_subjects, top_k=5):
+    """Top-k careers for many users at once.
+
+    One GCN pass embeds every user, a single matrix product scores them
+    against every career, and argpartition picks each user's top k.
+    """
+    user_embeddings = F.normalize(embed_users(artifact, user_features, user_subjects), dim=1).numpy()
+    similarities = user_embeddings @ artifact["career_embeddings_norm"].numpy().T  # users x careers
+
+    k = min(top_k, similarities.shape[1])
+    top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(similarities, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    top, top_scores = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+    return [[{
+        "career_id": artifact["career_ids"][i],
+        "career_name": artifact["career_names"][i],
+        "final_score": float(score)
+    } for i, score in zip(row, scores)] for row, scores in zip(top, top_scores)]
+
+
+def inputs_hash(user_features, selected_subjects, version):
+    """Fingerprint of everything a user's recommendations depend on."""
+    payload = json.dumps([[round(float(v), 4) for v in user_features], sorted(selected_subjects), version])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def career_recommendation(username, top_k=5):
+    user_subjects_df, user_ts_df = fetch_user_data(username)
+
+    if user_subjects_df.empty or user_ts_df.empty:
         print("Error: Missing data for user.")
         return []
 
@@ -173,37 +338,107 @@ def career_recommendation(username):
         print(f"Error extracting user thinking style features: {e}")
         return []
 
-    print("Extracted User Features:", user_features)  # Debugging output
+    artifact = load_artifact()
+    catalog = get_catalog()
+    if catalog is not None and catalog.version != artifact["version"]:
+        print(f"Warning: career catalog {catalog.version} is newer than recommender artifact "
+              f"{artifact['version']}; run train_recommender.py")
+    selected_subjects = split_subjects(user_subjects_df.iloc[0]['selected_subjects'])
+    recommendations = score_users(artifact, [user_features], [selected_subjects], top_k)[0]
 
-    data = build_graph(user_subjects_df, user_ts_df, careers_df)
+    print("Final Recommendations:", recommendations)
+    return recommendations
 
-    model = GNNRecommender(data.x.shape[1], 3, data.x.shape[1])
-    optimizer = torch.optim.Adam(model.parameters(), lr=0.01)
 
-    for epoch in range(100):
-        optimizer.zero_grad()
-        out = model(data)
-        loss = F.mse_loss(out, data.x)
-        loss.backward()
-        optimizer.step()
+# Precomputed recommendations (written by batch_recommend.py or on first request).
+# Rows are dropped whenever a user's subjects or thinking style change, and
+# only served while their inputs_hash matches the user's current inputs and
+# the artifact version, so a row computed from a stale profile is recomputed.
+RECOMMENDATIONS_TABLE = "career_recommendations"
+RECOMMENDATION_CACHE_TTL = float(os.getenv("RECOMMENDATION_CACHE_TTL", "60"))
+_recommendation_cache = {}  # username -> (stored_at, inputs_hash, recommendations)
 
-    user_embedding = out[0]
-    num_subjects = len([subj for subj in user_subjects_df.iloc[0]['selected_subjects'].split(',') if subj in data.x])
-    career_embeddings = out[num_subjects + 1:]
 
-    similarities = torch.cosine_similarity(user_embedding.unsqueeze(0), career_embeddings, dim=1)
-    top_careers = similarities.argsort(descending=True)[:5]
+def store_recommendations(rows):
+    """Upsert precomputed rows: {username, recommendations, inputs_hash, artifact_version}."""
+    if not rows:
+        return
+    supabase.table(RECOMMENDATIONS_TABLE).upsert(rows, on_conflict="username").execute()
+    now = time.monotonic()
+    for row in rows:
+        _recommendation_cache[row["username"]] = (now, row.get("inputs_hash"), row["recommendations"])
 
-    recommendations = []
-    for i in top_careers:
-        try:
-            recommendations.append({
-                "career_id": str(careers_df.iloc[i]['career_id']),
-                "career_name": str(careers_df.iloc[i]['career_name']),
-                "final_score": float(similarities[i].item())  # Convert safely
-            })
-        except Exception as e:
-            print(f"Error processing career {i}: {e}")
 
-    print("Final Recommendations:", recommendations)
+def invalidate_recommendations(username):
+    """Forget a user's precomputed recommendations after their inputs change."""
+    _recommendation_cache.pop(username, None)
+    try:
+        supabase.table(RECOMMENDATIONS_TABLE).delete().eq("username", username).execute()
+    except Exception as e:
+        print(f"Error invalidating recommendations for {username}: {e}")
+
+
+def invalidate_recommendations_many(usernames):
+    """invalidate_recommendations for several users in one DELETE."""
+    usernames = sorted({username for username in usernames if username})
+    if not usernames:
+        return
+    for username in usernames:
+        _recommendation_cache.pop(username, None)
+    try:
+        supabase.table(RECOMMENDATIONS_TABLE).delete().in_("username", usernames).execute()
+    except Exception as e:
+        print(f"Error invalidating recommendations for {len(usernames)} users: {e}")
+
+
+def user_inputs(username):
+    """(user_features, selected_subjects) for a user, or None; user_ts comes from the profile cache."""
+    rows = (supabase.table("user_subject_sel").select("id, selected_subjects")
+            .eq("username", username).limit(1).execute().data)
+    user_ts = get_user_ts(rows[0]["id"]) if rows else None
+    if not user_ts:
+        return None
+    return [float(user_ts.get(key) or 0) for key in STYLE_KEYS], split_subjects(rows[0]["selected_subjects"])
+
+
+def get_recommendations(username, top_k=5):
+    """Serve precomputed recommendations for the user's current inputs, computing and storing them on a miss."""
+    inputs = user_inputs(username)
+    if inputs is None:
+        print("Error: Missing data for user.")
+        return []
+    user_features, selected_subjects = inputs
+    # Stored rows can be checked against the version alone; the model is only loaded on a miss
+    version = artifact_version()
+    digest = inputs_hash(user_features, selected_subjects, version) if version else None
+
+    cached = _recommendation_cache.get(username)
+    if cached and time.monotonic() - cached[0] < RECOMMENDATION_CACHE_TTL and cached[1] == digest:
+        return cached[2][:top_k]
+
+    try:
+        rows = (supabase.table(RECOMMENDATIONS_TABLE).select("recommendations, inputs_hash")
+                .eq("username", username).limit(1).execute().data)
+    except Exception as e:
+        print(f"Error reading precomputed recommendations: {e}")
+        rows = []
+    # A row from older inputs or an older model is a miss, whoever wrote it and whenever.
+    # With no artifact on this host yet the row cannot be checked, but it beats training one.
+    if rows and rows[0]["recommendations"] and (digest is None or rows[0].get("inputs_hash") == digest):
+        recommendations = rows[0]["recommendations"]
+        _recommendation_cache[username] = (time.monotonic(), digest, recommendations)
+        return recommendations[:top_k]
+
+    artifact = load_artifact()
+    digest = inputs_hash(user_features, selected_subjects, artifact["version"])
+    recommendations = score_users(artifact, [user_features], [selected_subjects], top_k)[0]
+    try:
+        store_recommendations([{
+            "username": username,
+            "recommendations": recommendations,
+            "inputs_hash": digest,
+            "artifact_version": artifact["version"],
+        }])
+    except Exception as e:
+        print(f"Error storing recommendations: {e}")
     return recommendations
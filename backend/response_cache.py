@@ -0,0 +1,118 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+from intent_classifier import featurize
+
+# Cache of tutor answers (Doubt / Optimisation) keyed by the user's dominant
+# thinking style, the category and the normalized question. With
+# RESPONSE_CACHE_SIMILARITY > 0, a miss falls back to the most similar cached
+# question of the same style and category (cosine over the intent
+# classifier's hashed n-gram vectors).
+load_dotenv()
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "5000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0"))  # 0 = exact matches only
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_question(text):
+    text = _PUNCTUATION_RE.sub(" ", text.lower())
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def _vector(question):
+    indices, values = featurize(question)
+    return dict(zip(indices.tolist(), values.tolist()))
+
+
+def _cosine(a, b):
+    # featurize() vectors are already L2-normalised
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(i, 0.0) for i, v in a.items())
+
+
+class ResponseCache:
+    """LRU + TTL cache; thread-safe, process-local."""
+
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, similarity=RESPONSE_CACHE_SIMILARITY):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.similarity = similarity
+        self._entries = OrderedDict()  # key -> (stored_at, response, vector)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(style, category, question):
+        return (style or "unknown", category, normalize_question(question))
+
+    def get(self, style, category, question):
+        key = self.key(style, category, question)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+            if self.similarity <= 0:
+                self.misses += 1
+                return None
+            candidates = [(k, e) for k, e in self._entries.items()
+                          if k[:2] == key[:2] and now - e[0] < self.ttl]
+
+        # Similarity scan outside the lock; a bucket is at most maxsize entries
+        vector = _vector(key[2])
+        best, best_score = None, self.similarity
+        for k, (_, response, other) in candidates:
+            score = _cosine(vector, other)
+            if score >= best_score:
+                best, best_score = (k, response), score
+        with self._lock:
+            if best is None:
+                self.misses += 1
+                return None
+            self.similar_hits += 1
+            if best[0] in self._entries:
+                self._entries.move_to_end(best[0])
+            return best[1]
+
+    def set(self, style, category, question, response):
+        if not response:
+            return
+        key = self.key(style, category, question)
+        vector = _vector(key[2]) if self.similarity > 0 else None
+        with self._lock:
+            self._entries[key] = (time.time(), response, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.similar_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.similar_hits) / lookups, 4) if lookups else 0.0,
+            "similarity_threshold": self.similarity,
+        }
+
+
+response_cache = ResponseCache()
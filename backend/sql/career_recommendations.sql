@@ -0,0 +1,8 @@
+-- Precomputed career recommendations (batch_recommend.py / GET /career_recommendation)
+create table if not exists career_recommendations (
+    username text primary key,
+    recommendations jsonb not null,
+    inputs_hash text,
+    artifact_version text,
+    updated_at timestamptz not null default now()
+);
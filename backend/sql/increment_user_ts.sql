@@ -0,0 +1,57 @@
+-- Atomic, coalesced thinking-style updates (style_updates.py).
+-- Each element: {"id", "username", "first": {style: value}, "delta": {style: value}}.
+-- Existing rows get "delta" added server-side (no read-modify-write);
+-- missing rows are created with "first". Requires the double precision
+-- columns from user_ts_double_precision.sql, or every delta is rounded away.
+-- Each call carries a batch_id recorded in user_ts_batches, so retrying a
+-- batch whose first attempt committed (e.g. the response timed out) is a no-op.
+create table if not exists user_ts_batches (
+    batch_id   text primary key,
+    applied_at timestamptz not null default now()
+);
+
+drop function if exists increment_user_ts(jsonb);
+
+create or replace function increment_user_ts(batch_id text, updates jsonb) returns boolean
+language plpgsql as $$
+declare
+    u jsonb;
+begin
+    insert into user_ts_batches (batch_id) values (increment_user_ts.batch_id) on conflict do nothing;
+    if not found then
+        return false;  -- already applied
+    end if;
+
+    for u in select * from jsonb_array_elements(updates) loop
+        update user_ts set
+            username    = coalesce(u->>'username', username),
+            concrete    = concrete    + (u->'delta'->>'concrete')::float8,
+            logical     = logical     + (u->'delta'->>'logical')::float8,
+            theoretical = theoretical + (u->'delta'->>'theoretical')::float8,
+            practical   = practical   + (u->'delta'->>'practical')::float8,
+            intuitive   = intuitive   + (u->'delta'->>'intuitive')::float8,
+            "timestamp" = now()
+        where id = (u->>'id')::bigint;
+
+        if not found then
+            insert into user_ts as t (id, username, concrete, logical, theoretical, practical, intuitive, "timestamp")
+            values ((u->>'id')::bigint, u->>'username',
+                    (u->'first'->>'concrete')::float8, (u->'first'->>'logical')::float8,
+                    (u->'first'->>'theoretical')::float8, (u->'first'->>'practical')::float8,
+                    (u->'first'->>'intuitive')::float8, now())
+            -- another worker created the row in the meantime: fall back to the increment
+            on conflict (id) do update set
+                concrete    = t.concrete    + (u->'delta'->>'concrete')::float8,
+                logical     = t.logical     + (u->'delta'->>'logical')::float8,
+                theoretical = t.theoretical + (u->'delta'->>'theoretical')::float8,
+                practical   = t.practical   + (u->'delta'->>'practical')::float8,
+                intuitive   = t.intuitive   + (u->'delta'->>'intuitive')::float8,
+                "timestamp" = now();
+        end if;
+    end loop;
+    return true;
+end;
+$$;
+
+-- Applied batch ids only need to outlive the writer's retry window:
+-- delete from user_ts_batches where applied_at < now() - interval '1 day';
@@ -0,0 +1,9 @@
+-- Store thinking-style scores as floats. increment_user_ts adds small deltas
+-- (0.15 * a percentage) on every flush; integer columns would round each
+-- one away. Run once, before installing increment_user_ts.sql.
+alter table user_ts
+    alter column concrete    type double precision using concrete::double precision,
+    alter column logical     type double precision using logical::double precision,
+    alter column theoretical type double precision using theoretical::double precision,
+    alter column practical   type double precision using practical::double precision,
+    alter column intuitive   type double precision using intuitive::double precision;
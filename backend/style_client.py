@@ -0,0 +1,81 @@
+import os
+import json
+import socket
+from dotenv import load_dotenv
+
+# Client for style_server.py. When STYLE_SERVER_ADDRESS is unset, inference
+# runs in-process through apomind instead.
+load_dotenv()
+SERVER_ADDRESS = os.getenv("STYLE_SERVER_ADDRESS")  # e.g. unix:/tmp/apomind-style.sock or 127.0.0.1:8765
+REQUEST_TIMEOUT = float(os.getenv("STYLE_SERVER_TIMEOUT", "30"))
+
+
+def parse_address(address):
+    """Return ("unix", path) or ("tcp", (host, port))."""
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return "tcp", (host or "127.0.0.1", int(port))
+
+
+def _request(payload):
+    kind, target = parse_address(SERVER_ADDRESS)
+    family = socket.AF_UNIX if kind == "unix" else socket.AF_INET
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.settimeout(REQUEST_TIMEOUT)
+        sock.connect(target)
+        sock.sendall((json.dumps(payload) + "\n").encode("utf-8"))
+        with sock.makefile("r", encoding="utf-8") as f:
+            response = json.loads(f.readline())
+    if response.get("error"):
+        raise RuntimeError(response["error"])
+    return response
+
+
+def uses_server():
+    return bool(SERVER_ADDRESS)
+
+
+def infer_thinking_style(user_message):
+    """Thinking style percentages for one message, via the shared server if configured."""
+    if not uses_server():
+        from apomind import generate_thinking_style
+        return generate_thinking_style(user_message)
+    try:
+        return _request({"message": user_message})["styles"]
+    except Exception as e:
+        print("Style server request failed:", str(e))
+        return {"concrete": 0, "logical": 0, "theoretical": 0, "practical": 0, "intuitive": 0}
+
+
+def infer_thinking_style_batch(user_messages):
+    """Thinking style percentages for several messages in one model batch (or one server request)."""
+    if not user_messages:
+        return []
+    if not uses_server():
+        from apomind import generate_thinking_style_batch
+        return generate_thinking_style_batch(user_messages)
+    try:
+        return _request({"messages": user_messages})["styles"]
+    except Exception as e:
+        print("Style server request failed:", str(e))
+        return [{"concrete": 0, "logical": 0, "theoretical": 0, "practical": 0, "intuitive": 0}
+                for _ in user_messages]
+
+
+def status():
+    """Model readiness, from the server or the in-process model."""
+    if not uses_server():
+        import apomind
+        return apomind.status()
+    try:
+        return _request({"op": "status"})
+    except Exception as e:
+        return {"ready": False, "error": str(e)}
+
+
+def warm_up():
+    """Start loading the in-process model; a no-op when the shared server is used."""
+    if not uses_server():
+        import apomind
+        apomind.warm_up()
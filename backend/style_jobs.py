@@ -0,0 +1,132 @@
+import os
+import time
+import uuid
+import queue
+import logging
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# Background queue for thinking-style inference. Jobs are de-duplicated per
+# user: while a user's job is still queued, new messages are added to it
+# instead of creating another one. A fixed number of worker threads run the
+# handler, so model load is bounded no matter how busy the API is. Every
+# message is kept; the handler scores a job's messages in batches.
+load_dotenv()
+STYLE_JOB_WORKERS = int(os.getenv("STYLE_JOB_WORKERS", "1"))
+STYLE_JOB_BATCH_SIZE = int(os.getenv("STYLE_JOB_BATCH_SIZE", "8"))  # messages per model batch
+STYLE_JOB_HISTORY = int(os.getenv("STYLE_JOB_HISTORY", "10000"))  # finished jobs kept for status lookups
+
+
+class StyleJob:
+    def __init__(self, user_id):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.messages = []
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "user_id": self.user_id,
+            "status": self.status,
+            "messages": len(self.messages),
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class StyleJobQueue:
+    """handler(user_id, messages) runs on a worker thread and returns the job result."""
+
+    def __init__(self, handler, workers=STYLE_JOB_WORKERS, history=STYLE_JOB_HISTORY):
+        self.handler = handler
+        self.workers = workers
+        self.history = history
+        self._queue = queue.Queue()
+        self._pending = {}  # user_id -> queued (not yet started) job
+        self._jobs = OrderedDict()  # job id -> job, oldest first
+        self._lock = threading.Lock()
+        self._threads = []
+        self.completed = 0
+        self.failed = 0
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._threads = [threading.Thread(target=self._work, name=f"style-job-{i}", daemon=True)
+                             for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=30):
+        """Let queued jobs finish (up to `timeout` seconds), then stop the workers."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        deadline = time.time() + timeout
+        for thread in threads:
+            thread.join(max(0, deadline - time.time()))
+
+    def submit(self, user_id, message):
+        """Queue a message for user_id and return its job (an existing queued one when there is one)."""
+        with self._lock:
+            job = self._pending.get(user_id)
+            created = job is None
+            if created:
+                job = StyleJob(user_id)
+                self._pending[user_id] = job
+                self._jobs[job.id] = job
+                while len(self._jobs) > self.history:
+                    self._jobs.popitem(last=False)
+            job.messages.append(message)
+        if created:
+            self._queue.put(user_id)
+        if not self._threads:
+            self.start()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def _work(self):
+        while True:
+            user_id = self._queue.get()
+            if user_id is None:
+                return
+            with self._lock:
+                # Messages arriving from now on go to a new job
+                job = self._pending.pop(user_id)
+                job.status = "running"
+                job.started_at = time.time()
+            try:
+                result = self.handler(user_id, list(job.messages))
+            except Exception as e:
+                logging.error(f"Style job {job.id} for user {user_id} failed: {str(e)}")
+                job.status, job.error = "failed", str(e)
+                self.failed += 1
+            else:
+                job.status, job.result = "done", result
+                self.completed += 1
+            job.finished_at = time.time()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": len(self._threads),
+                "queued": len(self._pending),
+                "completed": self.completed,
+                "failed": self.failed,
+            }
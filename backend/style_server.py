@@ -0,0 +1,114 @@
+"""Shared thinking-style inference server.
+
+One process holds the phi-2 + LoRA model; every API worker talks to it over
+a Unix socket or localhost TCP (see style_client.py). Concurrent requests
+are collected into micro-batches before they hit the model.
+
+Usage:
+    STYLE_SERVER_ADDRESS=unix:/tmp/apomind-style.sock python style_server.py
+
+Protocol: one JSON object per line.
+    {"message": "..."}   -> {"styles": {...}}
+    {"messages": [...]}  -> {"styles": [{...}, ...]}
+    {"op": "status"}     -> apomind.status()
+"""
+import os
+import json
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+import apomind
+from style_client import SERVER_ADDRESS, parse_address
+
+load_dotenv()
+MAX_BATCH_SIZE = int(os.getenv("STYLE_MAX_BATCH_SIZE", "16"))
+MAX_WAIT_MS = float(os.getenv("STYLE_MAX_WAIT_MS", "10"))
+
+# The model runs on one dedicated thread; batching is what provides the throughput
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="style-model")
+_queue = None
+
+
+async def batch_worker():
+    """Drain the request queue in micro-batches of up to MAX_BATCH_SIZE / MAX_WAIT_MS."""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _queue.get()]
+        deadline = loop.time() + MAX_WAIT_MS / 1000
+        while len(batch) < MAX_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        messages = [message for message, _ in batch]
+        start = time.perf_counter()
+        try:
+            results = await loop.run_in_executor(_executor, apomind.generate_thinking_style_batch, messages)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+        print(f"Scored batch of {len(batch)} in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        for (_, future), styles in zip(batch, results):
+            if not future.done():
+                future.set_result(styles)
+
+
+async def handle_connection(reader, writer):
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+                if request.get("op") == "status":
+                    response = apomind.status()
+                elif "messages" in request:
+                    # Each message joins the micro-batches like a single request would
+                    futures = []
+                    for message in request["messages"]:
+                        futures.append(asyncio.get_running_loop().create_future())
+                        await _queue.put((message, futures[-1]))
+                    response = {"styles": list(await asyncio.gather(*futures))}
+                else:
+                    future = asyncio.get_running_loop().create_future()
+                    await _queue.put((request["message"], future))
+                    response = {"styles": await future}
+            except Exception as e:
+                response = {"error": str(e)}
+            writer.write((json.dumps(response) + "\n").encode("utf-8"))
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+async def main():
+    global _queue
+    _queue = asyncio.Queue()
+    apomind.warm_up()
+    asyncio.create_task(batch_worker())
+
+    kind, target = parse_address(SERVER_ADDRESS or "unix:/tmp/apomind-style.sock")
+    if kind == "unix":
+        if os.path.exists(target):
+            os.remove(target)
+        server = await asyncio.start_unix_server(handle_connection, path=target)
+    else:
+        server = await asyncio.start_server(handle_connection, host=target[0], port=target[1])
+
+    print(f"Style server listening on {SERVER_ADDRESS} (batch<= {MAX_BATCH_SIZE}, wait<= {MAX_WAIT_MS} ms)")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
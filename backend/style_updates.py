@@ -0,0 +1,99 @@
+import os
+import uuid
+import logging
+import threading
+from dotenv import load_dotenv
+
+from db import increment_user_ts, STYLE_KEYS
+from background_flush import BackgroundFlusher
+
+# Coalesces per-user thinking-style updates in memory and flushes them in
+# batches through the increment_user_ts RPC, so no request does a
+# read-modify-write of user_ts.
+load_dotenv()
+UPDATE_WEIGHT = 0.15  # user_ts = old + 0.15 * new, as update_thinking_style always did
+FLUSH_INTERVAL = float(os.getenv("STYLE_FLUSH_INTERVAL", "2.0"))
+FLUSH_SIZE = int(os.getenv("STYLE_FLUSH_SIZE", "200"))
+MAX_RETRIES = int(os.getenv("STYLE_FLUSH_RETRIES", "5"))
+
+
+class StyleUpdateAggregator(BackgroundFlusher):
+    """Accumulates float style deltas per user.
+
+    For every user two vectors are kept: `delta`, what to add if the row
+    already exists (0.15 * every observation), and `first`, what to insert
+    if it does not (the first observation in full, then 0.15 * the rest).
+    Flushing either gives exactly the result of applying the updates one by
+    one, without int truncation between them.
+    """
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, flush_size=FLUSH_SIZE, max_retries=MAX_RETRIES):
+        super().__init__(flush_interval, max_retries)
+        self.flush_size = flush_size
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._on_flush = []
+
+    def on_flush(self, callback):
+        """Register callback(updates) to run after a batch is written."""
+        self._on_flush.append(callback)
+
+    def add(self, user_id, username, styles):
+        """Record one observation; safe to call from any thread."""
+        self.add_batch(user_id, username, [styles])
+
+    def add_batch(self, user_id, username, observations):
+        """Record several observations for one user, oldest first, as a single update."""
+        if not observations:
+            return
+        with self._lock:
+            for styles in observations:
+                values = {key: float(styles.get(key, 0) or 0) for key in STYLE_KEYS}
+                entry = self._pending.get(user_id)
+                if entry is None:
+                    self._pending[user_id] = {
+                        "id": user_id,
+                        "username": username,
+                        "first": dict(values),
+                        "delta": {key: UPDATE_WEIGHT * v for key, v in values.items()},
+                    }
+                else:
+                    entry["username"] = username or entry["username"]
+                    for key, v in values.items():
+                        entry["first"][key] += UPDATE_WEIGHT * v
+                        entry["delta"][key] += UPDATE_WEIGHT * v
+            pending = len(self._pending)
+
+        if not self.running:
+            self.flush_now()  # no background task (scripts, tests)
+        elif pending >= self.flush_size:
+            self.wake()
+
+    def _take(self):
+        with self._lock:
+            updates, self._pending = list(self._pending.values()), {}
+        return updates
+
+    def _write(self, updates, batch_id):
+        increment_user_ts(updates, batch_id)
+        for callback in self._on_flush:
+            try:
+                callback(updates)
+            except Exception as e:
+                logging.error(f"Style flush callback failed: {str(e)}")
+
+    def flush_now(self):
+        """Synchronously write everything pending."""
+        self._write(self._take(), uuid.uuid4().hex)
+
+    async def drain(self):
+        updates = self._take()
+        if not updates:
+            return
+        # One id for every attempt: if an attempt committed but its response was lost,
+        # the retry is recognised server-side and not applied twice
+        await self.write_with_retries(self._write, updates, uuid.uuid4().hex,
+                                      name="Style flush", items=f"style updates for {len(updates)} users")
+
+
+style_updates = StyleUpdateAggregator()
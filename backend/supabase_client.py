@@ -1,15 +1,5 @@
-import os
-from dotenv import load_dotenv
-from supabase import create_client, Client
-
-# Load environment variables
-load_dotenv()
-
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-
-# Initialize Supabase Client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Shared Supabase client (see db.py)
+from db import supabase
 
 def get_user_data(user_id):
     """Fetch user's learning data from Supabase"""
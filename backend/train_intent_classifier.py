@@ -0,0 +1,79 @@
+"""Train and evaluate the local intent classifier from logged labels.
+
+Usage:
+    python train_intent_classifier.py --data intent_labels.jsonl --out intent_model.npz
+"""
+import argparse
+import time
+import numpy as np
+
+import intent_classifier
+from intent_classifier import LABELS, IntentModel, read_labels, train
+
+
+def evaluate(model, texts, labels, threshold):
+    """Print accuracy, per-label recall, coverage at the threshold and latency."""
+    predictions = []
+    start = time.perf_counter()
+    for text in texts:
+        predictions.append(model.predict(text))
+    per_call_ms = (time.perf_counter() - start) * 1000 / max(len(texts), 1)
+
+    correct = [pred == label for (pred, _), label in zip(predictions, labels)]
+    confident = [conf >= threshold for _, conf in predictions]
+    covered = [c for c, ok in zip(correct, confident) if ok]
+
+    print(f"Examples: {len(texts)}")
+    print(f"Accuracy: {np.mean(correct):.3f}")
+    print(f"Coverage at threshold {threshold}: {np.mean(confident):.3f} "
+          f"(accuracy on covered: {np.mean(covered) if covered else 0.0:.3f})")
+    for label in LABELS:
+        idx = [i for i, l in enumerate(labels) if l == label]
+        if idx:
+            recall = np.mean([correct[i] for i in idx])
+            print(f"  {label:<13} n={len(idx):<5} recall={recall:.3f}")
+    print(f"Latency: {per_call_ms:.3f} ms/message")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default=intent_classifier.LABEL_LOG_PATH)
+    parser.add_argument("--out", default=intent_classifier.MODEL_PATH)
+    parser.add_argument("--eval-split", type=float, default=0.2)
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--lr", type=float, default=0.5)
+    parser.add_argument("--threshold", type=float, default=intent_classifier.CONFIDENCE_THRESHOLD)
+    parser.add_argument("--eval-only", action="store_true", help="Evaluate an existing model on --data")
+    args = parser.parse_args()
+
+    texts, labels = read_labels(args.data)
+    if not texts:
+        raise SystemExit(f"No labelled examples in {args.data}")
+    missing = [label for label in LABELS if label not in labels]
+    if missing and not args.eval_only:
+        raise SystemExit(f"Not training: no examples for {', '.join(missing)} in {args.data}")
+
+    if args.eval_only:
+        evaluate(IntentModel.load(args.out), texts, labels, args.threshold)
+        return
+
+    order = np.random.default_rng(0).permutation(len(texts))
+    n_eval = int(len(texts) * args.eval_split)
+    eval_idx, train_idx = order[:n_eval], order[n_eval:]
+
+    if n_eval:
+        try:
+            model = train([texts[i] for i in train_idx], [labels[i] for i in train_idx],
+                          epochs=args.epochs, lr=args.lr)
+            evaluate(model, [texts[i] for i in eval_idx], [labels[i] for i in eval_idx], args.threshold)
+        except ValueError as e:
+            print(f"Skipping evaluation, the training split is incomplete: {e}")
+
+    # Refit on everything before saving
+    model = train(texts, labels, epochs=args.epochs, lr=args.lr)
+    model.save(args.out)
+    print(f"Saved model to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
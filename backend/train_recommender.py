@@ -0,0 +1,35 @@
+"""Train the career recommender offline and store a versioned artifact.
+
+The artifact version is a hash of the `career` table, so this is a no-op
+unless the catalog changed (or --force is given).
+
+Usage:
+    python train_recommender.py [--force] [--epochs 200]
+"""
+import argparse
+
+from recomendation import get_catalog, current_version, train_recommender, save_artifact
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--force", action="store_true", help="Retrain even if the catalog is unchanged")
+    parser.add_argument("--epochs", type=int, default=200)
+    args = parser.parse_args()
+
+    catalog = get_catalog(force=True)
+    if catalog is None:
+        raise SystemExit("Career catalog is empty")
+
+    if catalog.version == current_version() and not args.force:
+        print(f"Recommender artifact {catalog.version} is up to date")
+        return
+
+    artifact = train_recommender(catalog, epochs=args.epochs)
+    path = save_artifact(artifact)
+    print(f"Trained on {len(catalog.career_ids)} careers / {len(artifact['subject_to_idx'])} subjects "
+          f"(loss {artifact['loss']:.4f}); saved {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+import os
+import time
+import asyncio
+import logging
+import contextlib
+from email.utils import parsedate_to_datetime
+from dotenv import load_dotenv
+
+from background_flush import backoff_delay
+
+# Shared limits in front of OpenRouter: bounded concurrency with a queue-wait
+# timeout, a token-bucket rate limit, retries with jittered backoff that
+# honour Retry-After, and a circuit breaker that fails fast while the
+# upstream keeps erroring.
+load_dotenv()
+MAX_CONCURRENCY = int(os.getenv("OPENROUTER_MAX_CONCURRENCY", "32"))
+QUEUE_TIMEOUT = float(os.getenv("OPENROUTER_QUEUE_TIMEOUT", "10"))
+RATE_LIMIT = float(os.getenv("OPENROUTER_RATE_LIMIT", "0"))  # requests per second, 0 = unlimited
+RATE_BURST = int(os.getenv("OPENROUTER_RATE_BURST", "10"))
+MAX_RETRIES = int(os.getenv("OPENROUTER_MAX_RETRIES", "3"))
+BACKOFF_BASE = float(os.getenv("OPENROUTER_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("OPENROUTER_BACKOFF_MAX", "20"))
+RETRY_BUDGET = float(os.getenv("OPENROUTER_RETRY_BUDGET", "30"))  # total seconds one call may spend backing off
+BREAKER_THRESHOLD = int(os.getenv("OPENROUTER_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("OPENROUTER_BREAKER_COOLDOWN", "30"))
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def parse_retry_after(value):
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class UpstreamUnavailable(Exception):
+    """The call was not attempted: circuit open or no slot within the queue timeout."""
+
+    def __init__(self, reason, retry_after=None):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:  # first come, first served
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures; after `cooldown` one trial call is let through."""
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial_at = None  # when the half-open trial call was let through
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def check(self):
+        state = self.state
+        now = time.monotonic()
+        # A trial that never reported back (cancelled, unexpected error) expires after another cooldown
+        trial_pending = self._trial_at is not None and now - self._trial_at < self.cooldown
+        if state == "open" or (state == "half-open" and trial_pending):
+            remaining = self.cooldown - (now - self.opened_at)
+            raise UpstreamUnavailable("OpenRouter circuit open", retry_after=max(1.0, remaining))
+        if state == "half-open":
+            self._trial_at = now
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_at = None
+
+    def failure(self):
+        self.failures += 1
+        if self._trial_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None:
+                logging.warning(f"OpenRouter circuit opened after {self.failures} consecutive failures")
+            self.opened_at = time.monotonic()
+            self._trial_at = None
+
+
+class UpstreamGovernor:
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, queue_timeout=QUEUE_TIMEOUT, rate=RATE_LIMIT,
+                 burst=RATE_BURST, max_retries=MAX_RETRIES, breaker_threshold=BREAKER_THRESHOLD,
+                 breaker_cooldown=BREAKER_COOLDOWN):
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.rate = rate
+        self.burst = burst
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+        self._semaphore = None
+        self._bucket = None
+        self.active = 0
+        self.rejected = 0
+        self.retries = 0
+
+    def _primitives(self):
+        # Created lazily so they bind to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._bucket = TokenBucket(self.rate, self.burst) if self.rate > 0 else None
+        return self._semaphore, self._bucket
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Hold one upstream slot: breaker check, concurrency semaphore, then the rate limit."""
+        self.breaker.check()
+        semaphore, bucket = self._primitives()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise UpstreamUnavailable("Too many OpenRouter requests queued", retry_after=1.0)
+        self.active += 1
+        try:
+            if bucket:
+                await bucket.acquire()
+            yield
+        finally:
+            self.active -= 1
+            semaphore.release()
+
+    def record(self, error=None):
+        """Feed a call outcome to the breaker. Only 5xx and transport errors count as failures;
+        a 429 or other 4xx still proves the upstream is up."""
+        status = getattr(error, "status_code", None)
+        if error is not None and (status is None or status >= 500):
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+
+    def retry_delay(self, error, attempt, waited=0.0):
+        """Seconds to wait before retrying `error`, or None if it should not be retried.
+
+        `waited` is the backoff this call has already slept; retries that would
+        exceed RETRY_BUDGET, or a Retry-After above BACKOFF_MAX, fail instead.
+        """
+        status = getattr(error, "status_code", None)
+        retryable = status in RETRY_STATUS or status is None  # None: connection/timeout error
+        if not retryable or attempt >= self.max_retries:
+            return None
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None and retry_after > BACKOFF_MAX:
+            return None  # fail now; the client gets a 503 with this Retry-After instead of a long hang
+        backoff = backoff_delay(attempt, BACKOFF_BASE, BACKOFF_MAX)
+        delay = max(backoff, retry_after) if retry_after is not None else backoff
+        if waited + delay > RETRY_BUDGET:
+            return None
+        self.retries += 1
+        return delay
+
+    async def run(self, call, retry_on):
+        """Await `call()` under the limits, retrying `retry_on` errors that are transient."""
+        attempt, waited = 0, 0.0
+        while True:
+            async with self.slot():
+                try:
+                    result = await call()
+                except retry_on as e:
+                    self.record(e)
+                    delay = self.retry_delay(e, attempt, waited)
+                    if delay is None:
+                        raise
+                    error = e
+                else:
+                    self.record()
+                    return result
+            logging.warning(f"OpenRouter call failed ({str(error)}), retry {attempt + 1} in {delay:.1f}s")
+            await asyncio.sleep(delay)  # outside the slot so waiting does not hold concurrency
+            attempt += 1
+            waited += delay
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "max_concurrency": self.max_concurrency,
+            "rejected": self.rejected,
+            "retries": self.retries,
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+        }
+
+
+governor = UpstreamGovernor()